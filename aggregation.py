@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+
+import metrics
+
+# Resampling of DataCube selections to weeks or months for long date ranges, so a figure over
+# the whole history sends about as many bars as one over a couple of months. How a period is
+# summarized depends on the metric: daily figures add up, cumulative counters keep their last
+# value and levels (patients today, running means, incidences) are averaged.
+
+GRANULARITIES = ['day', 'week', 'month']
+# Periods per area the automatic granularity aims for
+TARGET_PERIODS = int(os.environ.get('TARGET_PERIODS', 62))
+# Bars (periods x areas) a figure may have whatever the granularity asked for; coarser above it
+MAX_POINTS = int(os.environ.get('MAX_POINTS', 2000))
+# Bars above which the per bar text labels are left out (the values are still in the hover)
+MAX_LABELS = int(os.environ.get('MAX_LABELS', 120))
+# Ticks on the date axis
+MAX_TICKS = 31
+
+SUM = 'sum'
+LAST = 'last'
+MEAN = 'mean'
+
+DAILY_METRICS = {'Casos confirmados por PCR nas últimas 24 horas', 'Novos positivos', 'Falecidos Diarios',
+                 *(f'Diff {column}' for column in metrics.DIFF_COLUMNS)}
+CUMULATIVE_METRICS = {'Contaxiados', 'Curados', 'Falecidos', 'Probas PCR realizadas',
+                      'Probas serolóxicas realizadas', 'Exitus'}
+
+
+def summary(metric):
+    if metric in DAILY_METRICS:
+        return SUM
+    if metric in CUMULATIVE_METRICS:
+        return LAST
+    return MEAN
+
+
+def period_starts(days, granularity):
+    # First day of the period of every day: weeks start on Monday (1970-01-01 was a Thursday)
+    if granularity == 'week':
+        return days - (days.astype('int64') + 3) % 7
+    if granularity == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    return days
+
+
+def period_bounds(start_date, end_date, granularity):
+    # First day of the period of start_date and last day of the period of end_date: a range
+    # widened to whole periods, so no period is summarized over only some of its days
+    first = period_starts(np.array([start_date], dtype='datetime64[D]'), granularity)[0]
+    last = np.datetime64(end_date, 'D')
+    if granularity == 'week':
+        last = period_starts(np.array([last]), granularity)[0] + 6
+    elif granularity == 'month':
+        last = (last.astype('datetime64[M]') + 1).astype('datetime64[D]') - 1
+    return first, last
+
+
+def choose_granularity(days, n_areas, requested='auto'):
+    # The requested granularity, or for 'auto' the finest one with at most TARGET_PERIODS
+    # periods; either way coarsened until the figure has at most MAX_POINTS bars
+    candidates = GRANULARITIES if requested not in GRANULARITIES else GRANULARITIES[GRANULARITIES.index(requested):]
+    for granularity in candidates:
+        periods = len(np.unique(period_starts(days, granularity)))
+        if (requested in GRANULARITIES or periods <= TARGET_PERIODS) and periods * max(n_areas, 1) <= MAX_POINTS:
+            return granularity
+    return GRANULARITIES[-1]
+
+
+def aggregate(selection, granularity, how):
+    # DataCube.select() selection of one metric resampled to granularity, with periods labelled
+    # by their first day. A period has a value for an area when one of its days has. Periods at
+    # the edges of the selection only have its days: select over period_bounds() first.
+    days, areas, values, present = selection
+    if granularity == 'day' or len(days) == 0:
+        return selection
+    starts = period_starts(days, granularity)
+    # days is sorted, so every period is a contiguous run
+    boundaries = np.r_[0, np.flatnonzero(starts[1:] != starts[:-1]) + 1]
+
+    values = values[:, :, 0].astype('float64')
+    valid = present & ~np.isnan(values)
+    counts = np.add.reduceat(valid, boundaries, axis=0)
+    if how == LAST:
+        # Index of the last valid day of every period and area
+        positions = np.where(valid, np.arange(len(days))[:, None], -1)
+        last = np.maximum.reduceat(positions, boundaries, axis=0)
+        result = values[np.maximum(last, 0), np.arange(len(areas))[None, :]]
+    else:
+        result = np.add.reduceat(np.where(valid, values, 0), boundaries, axis=0)
+        if how == MEAN:
+            result = result / np.maximum(counts, 1)
+    result[counts == 0] = np.nan
+    period_present = np.add.reduceat(present, boundaries, axis=0) > 0
+    return starts[boundaries], areas, result[:, :, None], period_present
@@ -0,0 +1,188 @@
+import datetime
+import hashlib
+import json
+
+import flask
+
+from cube import AREA
+
+# Read-only time series API on the Flask server:
+#   GET /api/v1/meta                               version, date range, areas and columns
+#   GET /api/v1/series?area=..&start=..&end=..&columns=..&format=json|csv
+#   GET /api/v1/exitus?...                         same, for the exitus data
+# area can be repeated (or comma separated), columns is comma separated, start/end are
+# YYYY-MM-DD and inclusive; everything is optional and defaults to all of it.
+#
+# Values come from the float32 DataCube the figures read, not from the float64 frames it is
+# built from: counters are exact, means and incidences have about 7 significant digits (a large
+# running mean may be off in its third or fourth decimal).
+#
+# Responses carry a strong ETag derived from the dataset version and the query, so a client
+# polling with If-None-Match gets a bodyless 304 until the data changes. Bodies are streamed a
+# chunk of days at a time: a full range export never sits in memory as a whole.
+
+API_PREFIX = '/api/v1'
+DATE = 'Data'
+CHUNK_DAYS = 60
+FORMATS = {'json': 'application/json', 'csv': 'text/csv'}
+# Dataset attribute holding the DataCube of each series
+SERIES = {'series': 'cube', 'exitus': 'exitus_cube'}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def error_response(message, status=400):
+    return flask.Response(json.dumps({'error': message}, ensure_ascii=False),
+                          status=status, mimetype='application/json')
+
+
+def parse_date(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise BadRequest(f'{name} must be YYYY-MM-DD, got {value!r}')
+
+
+def split_list(values, known):
+    # Comma separated lists. Two area names have a comma in them ('A.S. LUGO, A MARIÑA E
+    # MONFORTE'), so the longest run of pieces that is a known name is taken as one item.
+    items = []
+    for value in values:
+        pieces = value.split(',')
+        start = 0
+        while start < len(pieces):
+            end = next((end for end in range(len(pieces), start, -1)
+                        if ','.join(pieces[start:end]).strip() in known), start + 1)
+            item = ','.join(pieces[start:end]).strip()
+            if item:
+                items.append(item)
+            start = end
+    return items
+
+
+def parse_query(cube, args):
+    areas = split_list(args.getlist('area'), cube.area_positions) or list(cube.areas)
+    unknown = [a for a in areas if a not in cube.area_positions]
+    if unknown:
+        raise BadRequest(f'Unknown area(s): {", ".join(unknown)}')
+
+    columns = split_list(args.getlist('columns'), cube.metric_positions) or list(cube.metrics)
+    unknown = [c for c in columns if c not in cube.metric_positions]
+    if unknown:
+        raise BadRequest(f'Unknown column(s): {", ".join(unknown)}')
+
+    start = parse_date(args.get('start'), 'start')
+    end = parse_date(args.get('end'), 'end')
+    if start and end and start > end:
+        raise BadRequest('start is after end')
+    # An open range past the last day (polling for days not published yet) is just empty
+    start = start or cube.days[0].astype(datetime.date)
+    end = end or cube.days[-1].astype(datetime.date)
+
+    output_format = args.get('format', 'json')
+    if output_format not in FORMATS:
+        raise BadRequest(f'format must be one of {", ".join(FORMATS)}')
+    return {'areas': areas, 'columns': columns, 'start': start, 'end': end, 'format': output_format}
+
+
+def query_etag(version, name, query):
+    # Same dataset version + same query = same bytes
+    key = json.dumps([version, name, query['areas'], query['columns'], str(query['start']),
+                      str(query['end']), query['format']], ensure_ascii=False)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def day_chunks(start, end):
+    while start <= end:
+        chunk_end = min(start + datetime.timedelta(CHUNK_DAYS - 1), end)
+        yield start, chunk_end
+        start = chunk_end + datetime.timedelta(1)
+
+
+def chunk_frames(cube, query):
+    # Long (Data, Área Sanitaria, columns...) frames of the query, CHUNK_DAYS days at a time
+    for start, end in day_chunks(query['start'], query['end']):
+        frame = cube.to_frame(start, end, query['areas'], query['columns'], date_column=DATE)
+        if len(frame):
+            frame[DATE] = frame[DATE].dt.strftime('%Y-%m-%d')
+            yield frame
+
+
+def generate_csv(cube, query):
+    header = True
+    for frame in chunk_frames(cube, query):
+        # %.10g: counters as integers, means as to_frame() rounds the float32 values
+        yield frame.to_csv(index=False, header=header, float_format='%.10g')
+        header = False
+    if header:
+        yield ','.join([DATE, AREA] + query['columns']) + '\n'
+
+
+def generate_json(cube, query, version):
+    head = {'version': version, 'start': str(query['start']), 'end': str(query['end']),
+            'areas': query['areas'], 'columns': [DATE, AREA] + query['columns']}
+    # {"version": ..., ..., "data": [{"Data": ..., "Área Sanitaria": ..., ...}, ...]}
+    yield json.dumps(head, ensure_ascii=False)[:-1] + ', "data": ['
+    separator = ''
+    for frame in chunk_frames(cube, query):
+        records = frame.to_json(orient='records', force_ascii=False, double_precision=10)
+        yield separator + records[1:-1]
+        separator = ','
+    yield ']}'
+
+
+def serve_series(get_dataset, name):
+    def view():
+        dataset = get_dataset()
+        cube = getattr(dataset, SERIES[name])
+        try:
+            query = parse_query(cube, flask.request.args)
+        except BadRequest as e:
+            return error_response(str(e))
+
+        etag = query_etag(dataset.version, name, query)
+        if flask.request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+        else:
+            if query['format'] == 'csv':
+                body = generate_csv(cube, query)
+            else:
+                body = generate_json(cube, query, dataset.version)
+            response = flask.Response(flask.stream_with_context(body), mimetype=FORMATS[query['format']])
+            if query['format'] == 'csv':
+                response.headers['Content-Disposition'] = f'inline; filename="{name}.csv"'
+        response.set_etag(etag)
+        # Clients may keep the body, but have to revalidate it (cheap, see above) before using it
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    view.__name__ = f'api_{name}'
+    return view
+
+
+def serve_meta(get_dataset):
+    def api_meta():
+        dataset = get_dataset()
+        etag = hashlib.sha1(f'{dataset.version}-meta'.encode('utf-8')).hexdigest()
+        if flask.request.if_none_match.contains(etag):
+            response = flask.Response(status=304)
+        else:
+            meta = {'version': dataset.version}
+            for name, attribute in SERIES.items():
+                cube = getattr(dataset, attribute)
+                meta[name] = {'start': str(cube.days[0]), 'end': str(cube.days[-1]),
+                              'areas': list(cube.areas), 'columns': list(cube.metrics)}
+            response = flask.Response(json.dumps(meta, ensure_ascii=False), mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return api_meta
+
+
+def register_api(server, get_dataset):
+    server.add_url_rule(f'{API_PREFIX}/meta', view_func=serve_meta(get_dataset), methods=['GET'])
+    for name in SERIES:
+        server.add_url_rule(f'{API_PREFIX}/{name}', view_func=serve_series(get_dataset, name), methods=['GET'])
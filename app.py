@@ -1,368 +1,431 @@
 import time
+import_started = time.perf_counter()
 
-import pandas as pd
-import requests
-import io
+import collections
+import functools
+import hashlib
 import json
+import os
+import threading
 
-import plotly.express as px
+import numpy as np
+
+import plotly.io as pio
 
 import dash
-import dash_table
+import flask
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
 
 import datetime
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+
+import aggregation
+import datastore
+import figures
+import instrumentation
+import metrics
+import payloads
+import snapshots
+from api import register_api
+from cube import DataCube
+from figure_cache import FigureCache
+from refresher import DataRefresher
+from shared_data import materialize_cubes, memory_usage
+from table import TableIndex
+from windows import WindowEngine, load_prefix_sums
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css',
                         'https://use.fontawesome.com/releases/v5.15.1/css/all.css']
 
-NEED_NEW_DATA = False
-
-today = datetime.date.today()
-tomorrow = today + datetime.timedelta(1)
-yesterday = today - datetime.timedelta(1)
-before_yesterday = today - datetime.timedelta(2)
-population_galicia_2020 = 2701819
-
-app = dash.Dash(__name__,
-                title='Datos COVID19',
-                update_title='Cargando...',
-                external_stylesheets=external_stylesheets)
-app.config['suppress_callback_exceptions'] = True
-
-server = app.server
-
-
-def get_new_data(end_date):
-    # Configuration url for data at Sergas
-    config_url = 'https://coronavirus.sergas.gal/datos/libs/hot-config/hot-config.txt'
-
-    response_content = requests.get(config_url).content
-    json_content = json.loads(response_content)
-
-    for a_source in json_content['DATA_SOURCE']['FILES']:
-        print(a_source['URL'])
-
-    # Main dataframe to join daily data
-    main_df_ = pd.DataFrame()
-
-    for day in pd.date_range(start='2020-10-07', end=end_date):
-        daily_url = f"https://coronavirus.sergas.gal/infodatos/{str(day).split()[0]}_COVID19_Web_CifrasTotais.csv"
-        response = requests.get(daily_url)
-        if response.status_code == requests.codes.ok:  # i.e status = 200
-            daily_df = pd.read_csv(io.StringIO(response.content.decode('utf-8')), thousands='.', decimal=',')
-            main_df_ = pd.concat([main_df_, daily_df], ignore_index=True)
+Dataset = collections.namedtuple('Dataset', ['main_df',
+                                              'main_df_extended',
+                                              'activos_curados_falecidos_df',
+                                              'activos_curados_falecidos_extended',
+                                              'cube',
+                                              'exitus_cube',
+                                              'windows',
+                                              'table_df',
+                                              'table',
+                                              'row_counts',
+                                              'max_data',
+                                              'version'])
+
+# Directory for the memory-mapped dataset shared by all the gunicorn workers (unset: per worker copy)
+SHARED_DATA_DIR = os.environ.get('SHARED_DATA_DIR')
+# Refresh interval in seconds for the background refresher (0 disables it)
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', 3600))
+# Seconds between checks for data another worker downloaded
+REFRESH_POLL_INTERVAL = int(os.environ.get('REFRESH_POLL_INTERVAL', 60))
+# Client side filtering mode: series sent once to the browser, date/area/barmode changes rendered there
+CLIENTSIDE_FILTERING = os.environ.get('CLIENTSIDE_FILTERING', '0') == '1'
+# Seconds importing this module may take before a warning is printed (health checks time out on slow boots)
+IMPORT_TIME_BUDGET = float(os.environ.get('IMPORT_TIME_BUDGET', 2))
+# Requests slower than this many milliseconds get a sampling profile in PROFILE_DIR (unset: profiler off)
+PROFILE_SLOW_REQUESTS_MS = os.environ.get('PROFILE_SLOW_REQUESTS_MS')
+
+# Longest window the window-size control accepts, in days
+MAX_WINDOW = int(os.environ.get('MAX_WINDOW', 90))
+
+# Statistics of the window graph, see windows.py
+WINDOW_STATISTICS = {
+    'mean': 'Media',
+    'sum': 'Suma',
+    'incidence': 'Incidencia media por 100000 habs'
+}
+
+# Directory of the static snapshots of the common views, rebuilt after every refresh (unset: off)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR')
+# JSON file with the views to snapshot besides the default one, e.g.
+# [{"indicator": "Falecidos", "days": 30}, {"indicator": "Novos positivos", "areas": ["A.S. VIGO"]}]
+SNAPSHOT_VIEWS = os.environ.get('SNAPSHOT_VIEWS')
+
+# Rows per page of the data table
+TABLE_PAGE_SIZE = int(os.environ.get('TABLE_PAGE_SIZE', 25))
+TABLE_COLUMNS = ['Data', 'Área Sanitaria', 'Contaxiados', 'Casos confirmados por PCR nas últimas 24 horas',
+                 'Pacientes con infección activa', 'Curados', 'Hospitalizados hoxe', 'Coidados intensivos hoxe',
+                 'Probas PCR realizadas', 'Probas serolóxicas realizadas', 'Falecidos']
+
+# Granularity control: automatic (by date range) or fixed, see aggregation.py
+GRANULARITY_LABELS = {
+    'auto': 'Automática',
+    'day': 'Diaria',
+    'week': 'Semanal',
+    'month': 'Mensual'
+}
+
+# Area labels for the dropdown, in the order they are listed
+AREA_LABELS = {
+    'GALICIA': 'Galicia',
+    'A.S. A CORUÑA E CEE': 'A Coruña',
+    'A.S. LUGO, A MARIÑA E MONFORTE': 'Lugo',
+    'A.S. OURENSE, VERÍN E O BARCO': 'Ourense',
+    'A.S. PONTEVEDRA E O SALNÉS': 'Pontevedra',
+    'A.S. VIGO': 'Vigo',
+    'A.S. SANTIAGO E BARBANZA': 'Santiago',
+    'A.S. FERROL': 'Ferrol'
+}
+
+
+def build_dataset(previous=None):
+    # Builds every frame the callbacks read. It runs off the request path (at import and in the
+    # background refresher) and the result is only published once it is complete.
+    # previous is the dataset being replaced, used to compute the metrics of new days only.
+
+    # Typed store: counters are already int32 and Fecha is datetime64
+    with instrumentation.timed('load_total_data'):
+        main_df = datastore.load_total_data()
+    with instrumentation.timed('load_activos_curados_falecidos'):
+        activos_curados_falecidos_df = datastore.load_activos_curados_falecidos()
+
+    # Change column names for nicer representation
+    main_df.set_axis(['Fecha',
+                      'Área Sanitaria',
+                      'Contaxiados',
+                      'Casos confirmados por PCR nas últimas 24 horas',
+                      'Pacientes con infección activa',
+                      'Curados',
+                      'Hospitalizados hoxe',
+                      'Coidados intensivos hoxe',
+                      'Probas PCR realizadas',
+                      'Probas serolóxicas realizadas',
+                      'Falecidos'],
+                     axis=1, inplace=True)
+
+    activos_curados_falecidos_df.set_axis(['Data',
+                                           'Área Sanitaria',
+                                           'Pacientes Sen Alta',
+                                           'Pacientes Con Alta',
+                                           'Exitus'],
+                                          axis=1, inplace=True)
+    # Create date column
+    main_df['Data'] = main_df['Fecha'].dt.date
+
+    # Diffs, sums and running means per area (cached on disk by data version)
+    metrics_version = metrics.data_version(main_df)
+    # The figures also depend on the exitus data, so it is part of the dataset version
+    version = hashlib.sha1(f'{metrics_version}{metrics.data_version(activos_curados_falecidos_df)}'
+                           .encode('utf-8')).hexdigest()
+
+    def build_extended():
+        if previous is None or previous.main_df_extended is None:
+            main_df_extended = metrics.load_metrics(main_df, version=metrics_version)
         else:
-            print(f'Content for {day} not available. Status code: {response.status_code}')
-
-    main_df_.to_csv('total_data.csv', index=False)
-
-
-def get_activos_curados_falecidos(a_day):
-    yesterday = a_day - datetime.timedelta(1)
-    yesterday_str = yesterday.strftime('%Y-%m-%d')
-    activos_curados_falecidos_url = f"https://coronavirus.sergas.gal/infodatos/{yesterday_str}_COVID19_" \
-                                    f"Web_ActivosCuradosFallecidos.csv"
-    response = requests.get(activos_curados_falecidos_url)
+            main_df_extended = metrics.load_metrics(main_df,
+                                                    version=metrics_version,
+                                                    previous_main_df=previous.main_df,
+                                                    previous_extended_df=previous.main_df_extended)
+        with instrumentation.timed('metrics.exitus'):
+            activos_curados_falecidos_extended = metrics.compute_exitus_metrics(activos_curados_falecidos_df)
+        return main_df_extended, activos_curados_falecidos_extended
+
+    table_df = main_df[TABLE_COLUMNS]
+    row_counts = {'total_data': len(main_df), 'activos_curados_falecidos': len(activos_curados_falecidos_df)}
+    max_data = max(main_df['Data'])
+
+    if SHARED_DATA_DIR:
+        # Shared mode: the callbacks only read the cubes, the window prefix sums and the table
+        # index, which are mapped from files shared by every worker. None of the frames is kept
+        # in this process once the version and the gauges are computed; what stays private is
+        # the labels (areas, metrics, columns) and the per area slices of the table index.
+        def build_cubes():
+            main_df_extended, activos_curados_falecidos_extended = build_extended()
+            cube = DataCube(main_df_extended)
+            return {'main': cube, 'exitus': DataCube(activos_curados_falecidos_extended),
+                    'windows': WindowEngine(cube), 'table': TableIndex(table_df)}
+
+        with instrumentation.timed('cubes'):
+            cubes = materialize_cubes(SHARED_DATA_DIR, version, build_cubes,
+                                      loaders={'windows': load_prefix_sums, 'table': TableIndex.load})
+        cube, exitus_cube = cubes['main'], cubes['exitus']
+        # A version materialized before the window graph or the table index existed does not
+        # have them: computed here
+        windows = WindowEngine(cube, **cubes.get('windows', {}))
+        table = cubes['table'] if 'table' in cubes else TableIndex(table_df)
+        main_df = main_df_extended = None
+        activos_curados_falecidos_df = activos_curados_falecidos_extended = None
+        table_df = None
+    else:
+        main_df_extended, activos_curados_falecidos_extended = build_extended()
+        with instrumentation.timed('cubes'):
+            cube, exitus_cube = DataCube(main_df_extended), DataCube(activos_curados_falecidos_extended)
+        with instrumentation.timed('windows'):
+            windows = WindowEngine(cube)
+        with instrumentation.timed('table'):
+            table = TableIndex(table_df)
+
+    return Dataset(main_df=main_df,
+                   main_df_extended=main_df_extended,
+                   activos_curados_falecidos_df=activos_curados_falecidos_df,
+                   activos_curados_falecidos_extended=activos_curados_falecidos_extended,
+                   cube=cube,
+                   exitus_cube=exitus_cube,
+                   windows=windows,
+                   table_df=table_df,
+                   table=table,
+                   row_counts=row_counts,
+                   max_data=max_data,
+                   version=version)
+
+
+# Figures by dataset version and callback inputs: FIGURE_CACHE is memory, filesystem or none
+figure_cache = FigureCache(backend=os.environ.get('FIGURE_CACHE', 'memory'),
+                           max_entries=int(os.environ.get('FIGURE_CACHE_SIZE', 128)),
+                           cache_dir=os.environ.get('FIGURE_CACHE_DIR', 'figure_cache'))
+
+# The data is loaded on first use (first callback or warm_up()), never at import
+refresher = None
+refresher_lock = threading.Lock()
+# Called from a background thread with every dataset published, the first one included
+dataset_listeners = []
+
+
+def get_dataset():
+    global refresher
+    if refresher is None:
+        with refresher_lock:
+            if refresher is None:
+                new_refresher = DataRefresher(build_dataset, REFRESH_INTERVAL, REFRESH_POLL_INTERVAL)
+                new_refresher.add_listener(lambda dataset: figure_cache.invalidate(dataset.version))
+                for listener in dataset_listeners:
+                    new_refresher.add_listener(listener)
+                new_refresher.start()
+                refresher = new_refresher
+                for listener in dataset_listeners:
+                    threading.Thread(target=listener, args=(refresher.dataset,), daemon=True).start()
+                print(f'Worker memory: {memory_usage()}')
+    return refresher.dataset
+
+
+def dataset_gauge(value):
+    # Gauge function reading the published dataset, nothing to report until it is loaded
+    def read():
+        return None if refresher is None else value(refresher)
+    return read
+
+
+instrumentation.register(instrumentation.Gauge(
+    'covid_dataset_age_seconds', 'Seconds since the data store behind the published dataset was written',
+    dataset_gauge(lambda r: time.time() - r.data_version if r.data_version else None)))
+instrumentation.register(instrumentation.Gauge(
+    'covid_dataset_loaded_timestamp_seconds', 'When the published dataset was built',
+    dataset_gauge(lambda r: r.loaded_at)))
+instrumentation.register(instrumentation.Gauge(
+    'covid_dataset_last_day_timestamp_seconds', 'Last day with data in the published dataset',
+    dataset_gauge(lambda r: time.mktime(r.dataset.max_data.timetuple()))))
+instrumentation.register(instrumentation.Gauge(
+    'covid_dataset_rows', 'Rows of the frames of the published dataset',
+    dataset_gauge(lambda r: [({'frame': frame}, rows) for frame, rows in r.dataset.row_counts.items()]),
+    ['frame']))
+instrumentation.register(instrumentation.Gauge(
+    'covid_figure_cache_entries', 'Figures held by the in-memory figure cache', lambda: len(figure_cache.memory)))
+
+
+def warm_up():
+    # Loads the dataset ahead of the first request (create_app runs it in a background thread)
+    get_dataset()
+
+
+def layout_metadata():
+    # Last date and areas: from the dataset once loaded, else read cheaply from the store
+    if refresher is not None:
+        dataset = refresher.dataset
+        return dataset.max_data, dataset.cube.areas
+    return datastore.load_total_data_metadata()
 
-    if response.status_code == requests.codes.ok:  # i.e status = 200
-        activos_curados_falecidos_df = pd.read_csv(io.StringIO(response.content.decode('utf-8')), thousands='.',
-                                                   decimal=',')
 
-        activos_curados_falecidos_df.to_csv('activos_curados_falecidos.csv', index=False)
-        print('GOT activos_curados_falecidos')
-    else:
-        print('Unable to get activos_curados_falecidos')
-
-
-if NEED_NEW_DATA:
-    get_new_data(today)
-    get_activos_curados_falecidos(today)
-
-main_df = pd.read_csv('total_data.csv')
-activos_curados_falecidos_df = pd.read_csv('activos_curados_falecidos.csv')
-
-# Type conversion
-main_df[['Casos_Totais',
-         'Casos_Confirmados_PCR_Ultimas24h',
-         'Pacientes_Sin_Alta',
-         'Pacientes_Con_Alta',
-         'Camas_Ocupadas_HOS',
-         'Camas_Ocupadas_UCI',
-         'Probas_Realizadas_PCR',
-         'Probas_Realizadas_Non_PCR',
-         'Exitus']] = \
-    main_df[['Casos_Totais',
-             'Casos_Confirmados_PCR_Ultimas24h',
-             'Pacientes_Sin_Alta',
-             'Pacientes_Con_Alta',
-             'Camas_Ocupadas_HOS',
-             'Camas_Ocupadas_UCI',
-             'Probas_Realizadas_PCR',
-             'Probas_Realizadas_Non_PCR',
-             'Exitus']].apply(pd.to_numeric)
-main_df[['Fecha']] = main_df[['Fecha']].apply(pd.to_datetime)
-
-activos_curados_falecidos_df[['Pacientes_Sin_Alta', 'Pacientes_Con_Alta', 'Exitus']] = \
-    activos_curados_falecidos_df[['Pacientes_Sin_Alta', 'Pacientes_Con_Alta', 'Exitus']].apply(pd.to_numeric)
-activos_curados_falecidos_df[['Fecha']] = activos_curados_falecidos_df[['Fecha']].apply(pd.to_datetime)
-
-# Change column names for nicer representation
-main_df.set_axis(['Fecha',
-                  'Área Sanitaria',
-                  'Contaxiados',
-                  'Casos confirmados por PCR nas últimas 24 horas',
-                  'Pacientes con infección activa',
-                  'Curados',
-                  'Hospitalizados hoxe',
-                  'Coidados intensivos hoxe',
-                  'Probas PCR realizadas',
-                  'Probas serolóxicas realizadas',
-                  'Falecidos'],
-                 axis=1, inplace=True)
-
-activos_curados_falecidos_df.set_axis(['Data',
-                                       'Área Sanitaria',
-                                       'Pacientes Sen Alta',
-                                       'Pacientes Con Alta',
-                                       'Exitus'],
-                                      axis=1, inplace=True)
-# Create date column
-main_df['Data'] = pd.to_datetime(main_df['Fecha']).dt.date
-
-# Extend Dataframe with additional calculations
-main_df_extended = pd.concat([
-    main_df, main_df[
-        ['Casos confirmados por PCR nas últimas 24 horas',
-         'Falecidos',
-         'Curados',
-         'Contaxiados',
-         'Probas PCR realizadas',
-         'Pacientes con infección activa',
-         'Probas serolóxicas realizadas']
-    ].diff(periods=8).rename({
-        'Casos confirmados por PCR nas últimas 24 horas': 'Diff Casos confirmados por PCR nas últimas 24 horas',
-        'Falecidos': 'Diff Falecidos',
-        'Curados': 'Diff Curados',
-        'Contaxiados': 'Diff Contaxiados',
-        'Probas PCR realizadas': 'Diff Probas PCR realizadas',
-        'Pacientes con infección activa': 'Diff Pacientes con infección activa',
-        'Probas serolóxicas realizadas': 'Diff Probas serolóxicas realizadas'
-    },
-        axis=1)],
-    axis=1)
-
-#
-main_df_extended['Suma_Hospitalizados_UCI'] = main_df_extended['Hospitalizados hoxe'] + \
-                                              main_df_extended['Coidados intensivos hoxe']
-
-main_df_extended['Novos positivos'] = main_df_extended['Diff Pacientes con infección activa'] + \
-                                      main_df_extended['Diff Curados'] + \
-                                      main_df_extended['Diff Falecidos']
-# ----------- Running means
-# Calculate 1 and 2 weeks running mean grouped by 'Área Sanitaria'
-main_df_extended['Media 7 días'] = \
-    main_df_extended.groupby('Área Sanitaria')['Casos confirmados por PCR nas últimas 24 horas'].rolling(
-        window=7).mean().reset_index(0, drop=True)
-main_df_extended['Media 14 días'] = \
-    main_df_extended.groupby('Área Sanitaria')['Casos confirmados por PCR nas últimas 24 horas'].rolling(
-        14).mean().reset_index(0, drop=True)
-
-main_df_extended['Media 7 días Casos Activos'] = \
-    main_df_extended.groupby('Área Sanitaria')['Pacientes con infección activa'].rolling(
-        window=7).mean().reset_index(0, drop=True)
-main_df_extended['Media 14 días Casos Activos'] = \
-    main_df_extended.groupby('Área Sanitaria')['Pacientes con infección activa'].rolling(
-        14).mean().reset_index(0, drop=True)
-
-main_df_extended['Incidencia 7 días Casos Activos'] = \
-    main_df_extended.groupby('Área Sanitaria')['Pacientes con infección activa'].rolling(
-        window=7).mean().reset_index(0, drop=True)*100000/population_galicia_2020
-
-main_df_extended['Incidencia 14 días Casos Activos'] = \
-    main_df_extended.groupby('Área Sanitaria')['Pacientes con infección activa'].rolling(
-        14).mean().reset_index(0, drop=True)*100000/population_galicia_2020
-
-main_df_extended['Media 7 días Novos positivos'] = \
-    main_df_extended.groupby('Área Sanitaria')['Novos positivos'].rolling(window=7).mean().reset_index(0, drop=True)
-main_df_extended['Media 14 días Novos positivos'] = \
-    main_df_extended.groupby('Área Sanitaria')['Novos positivos'].rolling(14).mean().reset_index(0, drop=True)
-
-e_date = max(main_df['Data'])
-s_date = e_date - datetime.timedelta(6)
 today_year = datetime.date.today().year
 footer_year = f'2020 - {today_year}' if today_year != 2020 else '2020'
 
-table_df = main_df[['Data', 'Área Sanitaria', 'Contaxiados',
-                    'Casos confirmados por PCR nas últimas 24 horas',
-                    'Pacientes con infección activa', 'Curados', 'Hospitalizados hoxe',
-                    'Coidados intensivos hoxe', 'Probas PCR realizadas',
-                    'Probas serolóxicas realizadas', 'Falecidos']]
-
-table_df_transposed = table_df[table_df['Data'] >= before_yesterday]
-print(table_df_transposed.shape)
-table_df_transposed.set_index(['Data', 'Área Sanitaria'], inplace=True)
-print(table_df_transposed.T)
-# print(table_df_transposed.columns)
-# print(table_df_transposed.index)
-# table_df_transposed.set_index('Data', inplace=True)
-# print(table_df_transposed.index.names)
-max_data = max(table_df['Data'])
-print(type(max_data))
-print(max_data)
-#import sys
-#sys.exit(1)
-max_data_str = f"{max_data.day}/{max_data.month}/{max_data.year}"
-
-tab_content_table = html.Div([
-    dash_table.DataTable(
-        id='taboa',
-        columns=[{"name": i, "id": i} for i in table_df_transposed.T.columns.names],
-        data=table_df_transposed.to_dict('records'),
-        sort_action='native',
-        filter_action='native'
-    )
-])
-tab_content_table2 = html.Div([
-    dash_table.DataTable(
-        id='taboa',
-        columns=[{"name": i, "id": i} for i in table_df.columns],
-        data=table_df[table_df['Data'] >= before_yesterday].to_dict('records'),
-        sort_action='native',
-        filter_action='native'
-    )
-])
 
 # The layout
-app.layout = html.Div([
-    html.Div([
-        html.Img(src=app.get_asset_url('iconfinder-coronavirus-microscope-virus-laboratory-64.png')),
-        html.H1('Datos Coronavirus Sergas', style={'display': 'inline-block'}),
-        html.H6([f'Últimos datos: {max_data_str}. Fonte ',
-                 html.A("sergas", href="https://coronavirus.sergas.es/datos/#/gl-ES/galicia"), '/ Elaboración propia'])
-    ], style={'verticalAlign': 'middle'}),
-    html.Div([
+def serve_layout(app):
+    # Served on every page load, so the dates follow the dataset currently published by the refresher
+    max_data, areas = layout_metadata()
+    areas = [area for area in AREA_LABELS if area in areas] + [area for area in areas if area not in AREA_LABELS]
+    max_data_str = f"{max_data.day}/{max_data.month}/{max_data.year}"
+    e_date = max_data
+    s_date = e_date - datetime.timedelta(6)
+    return html.Div([
         html.Div([
-            html.Label("Indicador:"),
-            dcc.Dropdown(id='dropdown-parameter',
-                         options=[
-                             {'label': 'Pacientes con infección activa',
-                              'value': 'Pacientes con infección activa'},
-                             {'label': 'Casos confirmados por PCR nas últimas 24 horas',
-                              'value': 'Casos confirmados por PCR nas últimas 24 horas'},
-                             {'label': 'Hospitalizados hoxe',
-                              'value': 'Hospitalizados hoxe'},
-                             {'label': 'Falecidos',
-                              'value': 'Falecidos'},
-                             {'label': 'Contaxiados',
-                              'value': 'Contaxiados'},
-                             {'label': 'Curados',
-                              'value': 'Curados'},
-                             {'label': 'Probas PCR realizadas',
-                              'value': 'Probas PCR realizadas'},
-                             {'label': 'Probas serolóxicas realizadas',
-                              'value': 'Probas serolóxicas realizadas'},
-                             {'label': 'Coidados intensivos hoxe',
-                              'value': 'Coidados intensivos hoxe'},
-                             {'label': 'Diferenza de casos confirmados por PCR nas últimas 24 horas',
-                              'value': 'Diff Casos confirmados por PCR nas últimas 24 horas'},
-                             {'label': 'Diferenza de probas PCR realizadas con respecto ao día anterior',
-                              'value': 'Diff Probas PCR realizadas'},
-                             {'label': 'Diferenza de probas serolóxicas realizadas con respecto ao día anterior',
-                              'value': 'Diff Probas serolóxicas realizadas'},
-                             {'label': 'Diferenza de Contaxiados con respecto ao día anterior',
-                              'value': 'Diff Contaxiados'},
-                             {'label': 'Diferenza de curados con respecto ao día anterior',
-                              'value': 'Diff Curados'},
-                             {'label': 'Diferenza de falecidos con respecto ao día anterior',
-                              'value': 'Diff Falecidos'},
-                             {'label': 'Diferenza de pacientes con infeción activa con respecto ao día anterior',
-                              'value': 'Diff Pacientes con infección activa'},
-                             {'label': 'Suma de hospitalizados e UCI',
-                              'value': 'Suma_Hospitalizados_UCI'},
-                             {'label': 'Novos positivos',
-                              'value': 'Novos positivos'}
-                         ],
-                         value='Casos confirmados por PCR nas últimas 24 horas',
-                         clearable=False
-                         ),
-            html.Label("Área Sanitaria:"),
-            dcc.Dropdown(id='dropdown-area',
-                         options=[
-                             {'label': 'Galicia',
-                              'value': 'GALICIA'},
-                             {'label': 'A Coruña',
-                              'value': 'A.S. A CORUÑA E CEE'},
-                             {'label': 'Lugo',
-                              'value': 'A.S. LUGO, A MARIÑA E MONFORTE'},
-                             {'label': 'Ourense',
-                              'value': 'A.S. OURENSE, VERÍN E O BARCO'},
-                             {'label': 'Pontevedra',
-                              'value': 'A.S. PONTEVEDRA E O SALNÉS'},
-                             {'label': 'Vigo',
-                              'value': 'A.S. VIGO'},
-                             {'label': 'Santiago',
-                              'value': 'A.S. SANTIAGO E BARBANZA'},
-                             {'label': 'Ferrol',
-                              'value': 'A.S. FERROL'}
-                         ],
-                         value=['GALICIA',
-                                'A.S. A CORUÑA E CEE',
-                                'A.S. LUGO, A MARIÑA E MONFORTE',
-                                'A.S. OURENSE, VERÍN E O BARCO',
-                                'A.S. PONTEVEDRA E O SALNÉS',
-                                'A.S. VIGO',
-                                'A.S. SANTIAGO E BARBANZA',
-                                'A.S. FERROL'
-                                ],
-                         multi=True,
-                         clearable=False),
-        ], className='six columns'),
+            html.Img(src=app.get_asset_url('iconfinder-coronavirus-microscope-virus-laboratory-64.png')),
+            html.H1('Datos Coronavirus Sergas', style={'display': 'inline-block'}),
+            html.H6([f'Últimos datos: {max_data_str}. Fonte ',
+                     html.A("sergas", href="https://coronavirus.sergas.es/datos/#/gl-ES/galicia"), '/ Elaboración propia'])
+        ], style={'verticalAlign': 'middle'}),
         html.Div([
-            html.Label("Datas:"),
-            dcc.DatePickerRange(
-                id='date-picker',
-                start_date=s_date,
-                end_date=e_date,
-                display_format='D-M-Y',
-                # className='ten columns',
-                first_day_of_week=1,
-                min_date_allowed='2020-10-07',
-                max_date_allowed=str(max_data+datetime.timedelta(1))
-            ),
-            html.Label("Disposición:"),
+            html.Div([
+                html.Label("Indicador:"),
+                dcc.Dropdown(id='dropdown-parameter',
+                             options=[
+                                 {'label': 'Pacientes con infección activa',
+                                  'value': 'Pacientes con infección activa'},
+                                 {'label': 'Casos confirmados por PCR nas últimas 24 horas',
+                                  'value': 'Casos confirmados por PCR nas últimas 24 horas'},
+                                 {'label': 'Hospitalizados hoxe',
+                                  'value': 'Hospitalizados hoxe'},
+                                 {'label': 'Falecidos',
+                                  'value': 'Falecidos'},
+                                 {'label': 'Contaxiados',
+                                  'value': 'Contaxiados'},
+                                 {'label': 'Curados',
+                                  'value': 'Curados'},
+                                 {'label': 'Probas PCR realizadas',
+                                  'value': 'Probas PCR realizadas'},
+                                 {'label': 'Probas serolóxicas realizadas',
+                                  'value': 'Probas serolóxicas realizadas'},
+                                 {'label': 'Coidados intensivos hoxe',
+                                  'value': 'Coidados intensivos hoxe'},
+                                 {'label': 'Diferenza de casos confirmados por PCR nas últimas 24 horas',
+                                  'value': 'Diff Casos confirmados por PCR nas últimas 24 horas'},
+                                 {'label': 'Diferenza de probas PCR realizadas con respecto ao día anterior',
+                                  'value': 'Diff Probas PCR realizadas'},
+                                 {'label': 'Diferenza de probas serolóxicas realizadas con respecto ao día anterior',
+                                  'value': 'Diff Probas serolóxicas realizadas'},
+                                 {'label': 'Diferenza de Contaxiados con respecto ao día anterior',
+                                  'value': 'Diff Contaxiados'},
+                                 {'label': 'Diferenza de curados con respecto ao día anterior',
+                                  'value': 'Diff Curados'},
+                                 {'label': 'Diferenza de falecidos con respecto ao día anterior',
+                                  'value': 'Diff Falecidos'},
+                                 {'label': 'Diferenza de pacientes con infeción activa con respecto ao día anterior',
+                                  'value': 'Diff Pacientes con infección activa'},
+                                 {'label': 'Suma de hospitalizados e UCI',
+                                  'value': 'Suma_Hospitalizados_UCI'},
+                                 {'label': 'Novos positivos',
+                                  'value': 'Novos positivos'}
+                             ],
+                             value='Casos confirmados por PCR nas últimas 24 horas',
+                             clearable=False
+                             ),
+                html.Label("Área Sanitaria:"),
+                dcc.Dropdown(id='dropdown-area',
+                             options=[{'label': AREA_LABELS.get(area, area), 'value': area} for area in areas],
+                             value=areas,
+                             multi=True,
+                             clearable=False),
+            ], className='six columns'),
+            html.Div([
+                html.Label("Datas:"),
+                dcc.DatePickerRange(
+                    id='date-picker',
+                    start_date=s_date,
+                    end_date=e_date,
+                    display_format='D-M-Y',
+                    # className='ten columns',
+                    first_day_of_week=1,
+                    min_date_allowed='2020-10-07',
+                    max_date_allowed=str(max_data+datetime.timedelta(1))
+                ),
+                html.Label("Disposición:"),
+                dcc.RadioItems(
+                    id='radio-buttons',
+                    options=[
+                        {'label': 'Agrupada', 'value': 'group'},
+                        {'label': 'Apilada', 'value': 'stack'}
+                    ],
+                    value='group',
+                    labelStyle={'display': 'inline-block'}),
+                html.Label("Agregación:"),
+                dcc.RadioItems(
+                    id='granularity',
+                    options=[{'label': label, 'value': value} for value, label in GRANULARITY_LABELS.items()],
+                    value='auto',
+                    labelStyle={'display': 'inline-block'}),
+            ], className='six columns')
+        ]),
+
+        html.Hr(className='twelve columns'),
+        html.Div(dcc.Graph(id='main-graph'), className='twelve columns'),
+        html.Div(dcc.Graph(id='mean7-graph'), className='twelve columns'),
+        html.Div(dcc.Graph(id='mean14-graph'), className='twelve columns'),
+        html.Div(dcc.Graph(id='exitus-graph'), className='twelve columns'),
+        html.Div([
+            html.Label("Xanela (días):", className='two columns'),
+            dcc.Input(id='window-size', type='number', value=7, min=1, max=MAX_WINDOW, step=1, debounce=True,
+                      className='two columns'),
             dcc.RadioItems(
-                id='radio-buttons',
-                options=[
-                    {'label': 'Agrupada', 'value': 'group'},
-                    {'label': 'Apilada', 'value': 'stack'}
-                ],
-                value='group',
-                labelStyle={'display': 'inline-block'}),
-        ], className='six columns')
-    ]),
-
-    html.Hr(className='twelve columns'),
-    html.Div(dcc.Graph(id='main-graph'), className='twelve columns'),
-    html.Div(dcc.Graph(id='mean7-graph'), className='twelve columns'),
-    html.Div(dcc.Graph(id='mean14-graph'), className='twelve columns'),
-    html.Div(dcc.Graph(id='exitus-graph'), className='twelve columns'),
-    # tab_content_table,
-    html.Div([html.I(className='fab fa-creative-commons'),
-              html.I(className='fab fa-creative-commons-by'),
-              html.I(className='far fa-copyright fa-flip-horizontal'),
-              f" {footer_year} ", html.A("anuf",
-                                         href="https://github.com/anuf",
-                                         target="_blank"),
-              " Todos os dereitos garantidos."],
-             style={'textAlign': 'center',
-                    'background': 'black',
-                    'color': 'white'},
-             className='twelve columns'
-             )
-])
+                id='window-statistic',
+                options=[{'label': label, 'value': value} for value, label in WINDOW_STATISTICS.items()],
+                value='mean',
+                labelStyle={'display': 'inline-block'},
+                className='eight columns'),
+        ], className='twelve columns'),
+        html.Div(dcc.Graph(id='window-graph'), className='twelve columns'),
+        # Client side filtering mode: series of the indicator, checked for a new dataset every 10 minutes
+        *([dcc.Store(id='series-store'), dcc.Interval(id='series-refresh', interval=10 * 60 * 1000)]
+          if CLIENTSIDE_FILTERING else []),
+        # Whole history, paged, sorted and filtered on the server (table.py)
+        html.Div([
+            html.H5('Táboa de datos'),
+            dash_table.DataTable(
+                id='taboa',
+                columns=[{'name': column, 'id': column,
+                          'type': 'datetime' if column == 'Data' else 'text' if column == 'Área Sanitaria'
+                          else 'numeric'} for column in TABLE_COLUMNS],
+                page_action='custom',
+                page_current=0,
+                page_size=TABLE_PAGE_SIZE,
+                sort_action='custom',
+                sort_mode='multi',
+                sort_by=[],
+                filter_action='custom',
+                filter_query='')
+        ], className='twelve columns'),
+        html.Div([html.I(className='fab fa-creative-commons'),
+                  html.I(className='fab fa-creative-commons-by'),
+                  html.I(className='far fa-copyright fa-flip-horizontal'),
+                  f" {footer_year} ", html.A("anuf",
+                                             href="https://github.com/anuf",
+                                             target="_blank"),
+                  " Todos os dereitos garantidos."],
+                 style={'textAlign': 'center',
+                        'background': 'black',
+                        'color': 'white'},
+                 className='twelve columns'
+                 )
+    ])
 
 
 # app.layout = html.Div(children=[
@@ -482,189 +545,380 @@ app.layout = html.Div([
 # ])
 
 
-@app.callback(
-    [Output('main-graph', 'figure'),
-     Output('mean7-graph', 'figure'),
-     Output('mean14-graph', 'figure'),
-     Output('exitus-graph', 'figure')],
-    [Input('dropdown-parameter', 'value'),
-     Input('date-picker', 'start_date'), Input('date-picker', 'end_date'),
-     Input('radio-buttons', 'value'),
-     Input('dropdown-area', 'value')
-     ])
-def update_figure(dd_parameter, start_date, end_date, rb_value, dd_area):
-    df_to_figure = pd.DataFrame()
-    if len(dd_area) > 0:
-        start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
-        end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()  # datetime.date().fromisoformat(start_date)
-
-        df_to_figure = main_df_extended[main_df_extended.Data.between(start_date, end_date)]
-
-        df_to_figure = df_to_figure[df_to_figure['Área Sanitaria'].isin(dd_area)]
-
-        fig_to_update = px.bar(df_to_figure,
-                               x='Data',
-                               y=dd_parameter,
-                               text=dd_parameter,
-                               title=dd_parameter,
-                               barmode=rb_value,
-                               color="Área Sanitaria")
-
-        fig_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-
-        # fig_to_update = go.Figure()
-        # fig_to_update.add_trace(go.Scatter(x=df_to_figure['Data'],
-        #                                    y=df_to_figure[dd_parameter],
-        #                                    mode='lines',
-        #                                    name='lines'))
-        # fig_to_update.add_trace(go.Bar(x=df_to_figure['Data'],
-        #                                y=df_to_figure[dd_parameter],
-        #                                name=dd_parameter))
+# Running mean graphs for the indicators that have them: indicator -> ((column, title) for 7 and 14 days)
+MEAN_FIGURES = {
+    'Casos confirmados por PCR nas últimas 24 horas': (
+        ('Media 7 días', 'Media Casos confirmados por PCR (7 días)'),
+        ('Media 14 días', 'Media Casos confirmados por PCR (14 días)')),
+    'Novos positivos': (
+        ('Media 7 días Novos positivos', 'Media Novos Positivos (7 días)'),
+        ('Media 14 días Novos positivos', 'Media Novos Positivos (14 días)')),
+    'Pacientes con infección activa': (
+        ('Incidencia 7 días Casos Activos', 'Inciencia Media Casos Activos (7 días) por 100000 habs'),
+        ('Incidencia 14 días Casos Activos', 'Inciencia Media Casos Activos (14 días) por 100000 habs'))
+}
+
+figure_inputs = [Input('dropdown-parameter', 'value'),
+                 Input('date-picker', 'start_date'), Input('date-picker', 'end_date'),
+                 Input('radio-buttons', 'value'),
+                 Input('dropdown-area', 'value'),
+                 Input('granularity', 'value')]
+
+
+# The window graph also depends on the window controls
+window_inputs = figure_inputs + [Input('window-size', 'value'), Input('window-statistic', 'value')]
+
+
+def cached_figure(graph, build, dd_parameter, start_date, end_date, rb_value, dd_area, *extra):
+    # One snapshot per request: a refresh swapping the dataset meanwhile does not affect it
+    dataset = get_dataset()
+    # The figures do not depend on the order the areas were picked in
+    key = (graph, dd_parameter, start_date, end_date, rb_value, tuple(sorted(dd_area)), *extra)
+    return figure_cache.get_or_build(dataset.version, key,
+                                     lambda: build(dataset, dd_parameter, start_date, end_date, rb_value, dd_area,
+                                                   *extra))
+
+
+def parse_dates(start_date, end_date):
+    start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d').date()
+    end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d').date()  # datetime.date().fromisoformat(start_date)
+    return start_date, end_date
+
+
+def select(cube, dd_area, column):
+    # select_range(start, end) of one column of the cube, for resample()
+    return lambda start, end: cube.select(start, end, dd_area, [column])
+
 
-    else:
-        fig_to_update = {}
-
-    if dd_parameter == 'Casos confirmados por PCR nas últimas 24 horas':
-        fig_mean7_to_update = px.bar(df_to_figure,
-                                     x='Data',
-                                     y='Media 7 días',
-                                     text='Media 7 días',
-                                     title='Media Casos confirmados por PCR (7 días)',
-                                     barmode=rb_value,
-                                     color="Área Sanitaria")
-        fig_mean7_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_mean7_to_update.update_traces(texttemplate='%{text:.2f}')
-        fig_mean7_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-
-        fig_mean14_to_update = px.bar(df_to_figure,
-                                      x='Data',
-                                      y='Media 14 días',
-                                      text='Media 14 días',
-                                      title='Media Casos confirmados por PCR (14 días)',
-                                      barmode=rb_value,
-                                      color="Área Sanitaria")
-        fig_mean14_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_mean14_to_update.update_traces(texttemplate='%{text:.2f}')
-        fig_mean14_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-    elif dd_parameter == 'Novos positivos':
-        fig_mean7_to_update = px.bar(df_to_figure,
-                                     x='Data',
-                                     y='Media 7 días Novos positivos',
-                                     text='Media 7 días Novos positivos',
-                                     title='Media Novos Positivos (7 días)',
-                                     barmode=rb_value,
-                                     color="Área Sanitaria")
-        fig_mean7_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_mean7_to_update.update_traces(texttemplate='%{text:.2f}')
-        fig_mean7_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-
-        fig_mean14_to_update = px.bar(df_to_figure,
-                                      x='Data',
-                                      y='Media 14 días Novos positivos',
-                                      text='Media 14 días Novos positivos',
-                                      title='Media Novos Positivos (14 días)',
-                                      barmode=rb_value,
-                                      color="Área Sanitaria")
-        fig_mean14_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_mean14_to_update.update_traces(texttemplate='%{text:.2f}')
-        fig_mean14_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-    elif dd_parameter == 'Pacientes con infección activa':
-        fig_mean7_to_update = px.bar(df_to_figure,
-                                     x='Data',
-                                     y='Incidencia 7 días Casos Activos',
-                                     text='Incidencia 7 días Casos Activos',
-                                     title='Inciencia Media Casos Activos (7 días) por 100000 habs',
-                                     barmode=rb_value,
-                                     color="Área Sanitaria")
-        fig_mean7_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_mean7_to_update.update_traces(texttemplate='%{text:.2f}')
-        fig_mean7_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-
-        fig_mean14_to_update = px.bar(df_to_figure,
-                                      x='Data',
-                                      y='Incidencia 14 días Casos Activos',
-                                      text='Incidencia 14 días Casos Activos',
-                                      title='Inciencia Media Casos Activos (14 días) por 100000 habs',
-                                      barmode=rb_value,
-                                      color="Área Sanitaria")
-        fig_mean14_to_update.update_xaxes(
-            dtick=86400000.0,
-            tickformat="%d %b",
-            ticklabelmode="instant",
-            title_text='Data'
-        )
-        fig_mean14_to_update.update_traces(texttemplate='%{text:.2f}')
-        fig_mean14_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-    else:
-        fig_mean7_to_update = {}
-        fig_mean14_to_update = {}
-
-    activos_curados_falecidos_extended = pd.concat([
-        activos_curados_falecidos_df, activos_curados_falecidos_df[
-            ['Exitus']
-        ].diff(periods=8).rename({
-            'Exitus': 'Falecidos Diarios'
-        },
-            axis=1)],
-        axis=1)
-
-    activos_curados_falecidos_extended['Media 7 días'] = \
-        activos_curados_falecidos_extended.groupby('Área Sanitaria')['Falecidos Diarios'].rolling(
-            window=7).mean().reset_index(0, drop=True)
-
-    activos_curados_falecidos_to_figure = activos_curados_falecidos_extended[
-        activos_curados_falecidos_extended['Área Sanitaria'].isin(dd_area)]
+def resample(select_range, start_date, end_date, metric, granularity, how=None):
+    # The selection, in weeks or months for long ranges or when asked for: (selection, granularity
+    # used). Weeks and months are selected whole, so the first and last bars are not a sum over
+    # the days of their period that happen to be in the range.
+    start_date, end_date = parse_dates(start_date, end_date)
+    with instrumentation.timed('figure.select'):
+        selection = select_range(start_date, end_date)
+    with instrumentation.timed('figure.aggregate'):
+        granularity = aggregation.choose_granularity(selection[0], len(selection[1]), granularity)
+    if granularity == 'day':
+        return selection, granularity
+    with instrumentation.timed('figure.select'):
+        selection = select_range(*aggregation.period_bounds(start_date, end_date, granularity))
+    with instrumentation.timed('figure.aggregate'):
+        return aggregation.aggregate(selection, granularity, how or aggregation.summary(metric)), granularity
+
+
+def period_title(title, granularity):
+    return title if granularity == 'day' else f'{title} ({GRANULARITY_LABELS[granularity].lower()})'
+
+
+def build_main_figure(dataset, dd_parameter, start_date, end_date, rb_value, dd_area, granularity='auto'):
+    if len(dd_area) == 0:
+        return {}
+    selection, granularity = resample(select(dataset.cube, dd_area, dd_parameter), start_date, end_date,
+                                      dd_parameter, granularity)
+    return figures.bar_figure(selection, dd_parameter, period_title(dd_parameter, granularity), rb_value,
+                              granularity=granularity)
+
+
+def build_mean_figure(position):
+    def build(dataset, dd_parameter, start_date, end_date, rb_value, dd_area, granularity='auto'):
+        if dd_parameter not in MEAN_FIGURES or len(dd_area) == 0:
+            return {}
+        column, title = MEAN_FIGURES[dd_parameter][position]
+        selection, granularity = resample(select(dataset.cube, dd_area, column), start_date, end_date,
+                                          column, granularity)
+        return figures.bar_figure(selection, column, period_title(title, granularity), rb_value,
+                                  texttemplate='%{text:.2f}', granularity=granularity)
+    return build
+
+
+def build_exitus_figure(dataset, dd_parameter, start_date, end_date, rb_value, dd_area, granularity='auto'):
+    if dd_parameter != 'Falecidos' or len(dd_area) == 0:
+        return {}
+    selection, granularity = resample(select(dataset.exitus_cube, dd_area, 'Falecidos Diarios'), start_date, end_date,
+                                      'Falecidos Diarios', granularity)
+    return figures.area_figure(selection, 'Falecidos Diarios', period_title('Falecidos Diarios', granularity),
+                               granularity=granularity)
+
+
+def build_window_figure(dataset, dd_parameter, start_date, end_date, rb_value, dd_area, granularity='auto',
+                        window=7, statistic='mean'):
+    # Any window over any indicator, from the prefix sums of the cube (windows.py)
+    if len(dd_area) == 0 or not window or statistic not in WINDOW_STATISTICS:
+        return {}
+    window = min(max(int(window), 1), MAX_WINDOW)
+    # A period keeps the sum of the window ending on its last day, the mean of the others
+    selection, granularity = resample(
+        lambda start, end: dataset.windows.select(start, end, dd_area, dd_parameter, window, statistic),
+        start_date, end_date, dd_parameter, granularity,
+        how=aggregation.LAST if statistic == 'sum' else aggregation.MEAN)
+    title = f'{WINDOW_STATISTICS[statistic]} {dd_parameter} ({window} días)'
+    return figures.bar_figure(selection, title, period_title(title, granularity), rb_value,
+                              texttemplate='%{text:.0f}' if statistic == 'sum' else '%{text:.2f}',
+                              granularity=granularity)
+
+
+# One callback per graph, so every graph only does its own work and hidden ones return at once
+FIGURE_BUILDERS = {
+    'main-graph': build_main_figure,
+    'mean7-graph': build_mean_figure(0),
+    'mean14-graph': build_mean_figure(1),
+    'exitus-graph': build_exitus_figure,
+    'window-graph': build_window_figure
+}
+
+# Inputs of every graph callback, in the order the builders take them
+GRAPH_INPUTS = {graph: window_inputs if graph == 'window-graph' else figure_inputs for graph in FIGURE_BUILDERS}
+# Graphs the client side filtering mode draws in the browser (assets/clientside.js); the others
+# keep their server callback
+CLIENTSIDE_GRAPHS = ['main-graph', 'mean7-graph', 'mean14-graph', 'exitus-graph']
+
+
+def update_main_figure(*args):
+    return cached_figure('main-graph', FIGURE_BUILDERS['main-graph'], *args)
+
+
+def update_mean7_figure(*args):
+    return cached_figure('mean7-graph', FIGURE_BUILDERS['mean7-graph'], *args)
+
+
+def update_mean14_figure(*args):
+    return cached_figure('mean14-graph', FIGURE_BUILDERS['mean14-graph'], *args)
+
+
+def update_exitus_figure(*args):
+    return cached_figure('exitus-graph', FIGURE_BUILDERS['exitus-graph'], *args)
+
+
+def update_window_figure(*args):
+    return cached_figure('window-graph', FIGURE_BUILDERS['window-graph'], *args)
+
+
+def cached_payload(graph, *args):
+    # The whole callback response for a graph, serialized and compressed once and cached
+    # next to the figures
+    def build_payload(dataset, *args):
+        with instrumentation.timed_figure(graph, 'build'):
+            figure = FIGURE_BUILDERS[graph](dataset, *args)
+        with instrumentation.timed_figure(graph, 'serialize'):
+            return payloads.build_payload(graph, 'figure', figure)
+    return cached_figure(f'{graph}.payload', build_payload, *args)
+
+
+def series_graph(cube, metric, title, kind='bar', texttemplate=None):
+    # One graph of the series store: days as offsets from the first one and a list of values per
+    # area, with null where the area has no row or no value
+    position = cube.metric_positions[metric]
+    values = cube.values[:, :, position].astype('float64').round(4)
+    values[~cube.present] = np.nan
+    return {'title': title,
+            'kind': kind,
+            'texttemplate': texttemplate,
+            'start': str(cube.days[0]) if len(cube.days) else None,
+            'days': (cube.days - cube.days[0]).astype(int).tolist() if len(cube.days) else [],
+            'areas': cube.areas,
+            'values': np.where(np.isnan(values.T), None, values.T).tolist()}
+
+
+def build_series_store(dataset, dd_parameter):
+    graphs = {'main-graph': series_graph(dataset.cube, dd_parameter, dd_parameter)}
+    if dd_parameter in MEAN_FIGURES:
+        for graph, (column, title) in zip(['mean7-graph', 'mean14-graph'], MEAN_FIGURES[dd_parameter]):
+            graphs[graph] = series_graph(dataset.cube, column, title, texttemplate='%{text:.2f}')
     if dd_parameter == 'Falecidos':
-        fig_exitus_to_update = plot_exitus(activos_curados_falecidos_to_figure)
+        graphs['exitus-graph'] = series_graph(dataset.exitus_cube, 'Falecidos Diarios', 'Falecidos Diarios',
+                                              kind='area')
+    return {'version': dataset.version,
+            'indicator': dd_parameter,
+            'template': pio.templates['plotly'].to_plotly_json(),
+            'colors': figures.COLORS,
+            'max_labels': aggregation.MAX_LABELS,
+            'max_ticks': aggregation.MAX_TICKS,
+            'graphs': graphs}
+
+
+def update_series_store(dd_parameter, n_intervals, series_store):
+    # Only a new indicator or a new dataset version sends data; the interval tick is otherwise a no-op
+    dataset = get_dataset()
+    if series_store and series_store['version'] == dataset.version and series_store['indicator'] == dd_parameter:
+        return dash.no_update
+    def build():
+        with instrumentation.timed_figure('series-store', 'build'):
+            return build_series_store(dataset, dd_parameter)
+    return figure_cache.get_or_build(dataset.version, ('series-store', dd_parameter), build)
+
+
+def update_table(page_current, page_size, sort_by, filter_query):
+    # Only the rows of the page shown; the table keeps no data of its own
+    with instrumentation.timed('table.page'):
+        return get_dataset().table.page(page_current, page_size, sort_by, filter_query)
+
+
+def layout_values(component):
+    # {(id, property): value} of every component with an id in a serialized layout
+    values = {}
+    if isinstance(component, dict):
+        props = component.get('props', {})
+        if 'id' in props:
+            values.update({(props['id'], name): value for name, value in props.items()})
+        for value in props.values():
+            values.update(layout_values(value))
+    elif isinstance(component, list):
+        for child in component:
+            values.update(layout_values(child))
+    return values
+
+
+def snapshot_views(initial):
+    # Input values of the default view (the layout as served) and of every SNAPSHOT_VIEWS view
+    views = [{}]
+    if SNAPSHOT_VIEWS:
+        with open(SNAPSHOT_VIEWS, encoding='utf-8') as f:
+            views += json.load(f)
+    end_date = datetime.datetime.strptime(initial[('date-picker', 'end_date')], '%Y-%m-%d').date()
+    for view in views:
+        values = dict(initial)
+        if 'indicator' in view:
+            values[('dropdown-parameter', 'value')] = view['indicator']
+        if 'days' in view:
+            values[('date-picker', 'start_date')] = str(end_date - datetime.timedelta(view['days'] - 1))
+        if 'areas' in view:
+            values[('dropdown-area', 'value')] = view['areas']
+        if 'barmode' in view:
+            values[('radio-buttons', 'value')] = view['barmode']
+        if 'granularity' in view:
+            values[('granularity', 'value')] = view['granularity']
+        yield values
+
+
+def build_snapshots(app, dataset):
+    # The page and the responses of every server callback for the snapshot views, obtained from
+    # the app itself, so they are byte for byte what it would answer (snapshots.py)
+    try:
+        with instrumentation.timed('snapshots'):
+            client = app.server.test_client()
+            headers = {snapshots.BUILD_HEADER: '1'}
+            shell = {name: payloads.encode(client.get(path, headers=headers).get_data())
+                     for path, (name, _) in snapshots.SHELL.items()}
+            initial = layout_values(json.loads(shell['_dash-layout']['identity']))
+
+            callbacks = {}
+            for values in snapshot_views(initial):
+                for output, callback in app.callback_map.items():
+                    if 'callback' not in callback:
+                        # Clientside callback: the browser runs it, there is nothing to snapshot
+                        continue
+                    inputs = [{**i, 'value': values.get((i['id'], i['property']))} for i in callback['inputs']]
+                    key = snapshots.callback_key(output, inputs)
+                    if key in callbacks:
+                        # Same inputs as in an earlier view, e.g. the table
+                        continue
+                    state = [{**i, 'value': values.get((i['id'], i['property']))} for i in callback['state']]
+                    response = client.post(app.config.requests_pathname_prefix + '_dash-update-component',
+                                           json={'output': output, 'inputs': inputs, 'state': state,
+                                                 'changedPropIds': []},
+                                           headers=headers)
+                    if response.status_code == 200:
+                        callbacks[key] = payloads.encode(response.get_data())
+            snapshots.write_snapshot(SNAPSHOT_DIR, dataset.version, shell, callbacks)
+    except Exception as e:
+        # The app answers everything itself meanwhile
+        print(f'Snapshot failed: {e!r}')
+
+
+def serve_figure_payload():
+    # before_request hook: figure callbacks are answered here with the cached payload in the
+    # encoding the client accepts, without going through Dash's serializer or Flask-Compress
+    if not flask.request.path.endswith('/_dash-update-component'):
+        return None
+    body = flask.request.get_json(silent=True) or {}
+    graph, _, component_property = body.get('output', '').partition('.')
+    if graph not in FIGURE_BUILDERS or component_property != 'figure':
+        return None
+    if CLIENTSIDE_FILTERING and graph in CLIENTSIDE_GRAPHS:
+        # Drawn in the browser: no server callback, and the inputs are the clientside ones
+        return None
+
+    input_values = {(i['id'], i['property']): i.get('value') for i in body.get('inputs', [])}
+    args = [input_values.get((i.component_id, i.component_property)) for i in GRAPH_INPUTS[graph]]
+    payload = cached_payload(graph, *args)
+
+    encoding = payloads.choose_encoding(flask.request.headers.get('Accept-Encoding'))
+    response = flask.Response(payload[encoding], mimetype='application/json')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def create_app(warm_up_in_background=True):
+    # Cheap: the layout only needs the last date and the areas, the data itself is loaded by
+    # warm_up() in the background or by the first callback
+    app = dash.Dash(__name__,
+                    title='Datos COVID19',
+                    update_title='Cargando...',
+                    external_stylesheets=external_stylesheets)
+    app.config['suppress_callback_exceptions'] = True
+    app.layout = functools.partial(serve_layout, app)
+
+    if CLIENTSIDE_FILTERING:
+        app.callback(Output('series-store', 'data'),
+                     [Input('dropdown-parameter', 'value'), Input('series-refresh', 'n_intervals')],
+                     [State('series-store', 'data')])(update_series_store)
+        for graph in CLIENTSIDE_GRAPHS:
+            # assets/clientside.js: figures.main_graph, figures.mean7_graph, ...
+            app.clientside_callback(ClientsideFunction(namespace='figures', function_name=graph.replace('-', '_')),
+                                    Output(graph, 'figure'),
+                                    # The browser draws days only: granularity is a server side input
+                                    [Input('series-store', 'data')] + figure_inputs[1:5])
+        app.callback(Output('window-graph', 'figure'), window_inputs)(update_window_figure)
     else:
-        fig_exitus_to_update = {}
-
-    return fig_to_update, fig_mean7_to_update, fig_mean14_to_update, fig_exitus_to_update
-
-
-def plot_exitus(df_to_figure):
-    fig_to_update = px.area(df_to_figure,
-                            x='Data',
-                            y='Falecidos Diarios',
-                            # text='Falecidos Diarios',
-                            title='Falecidos Diarios',
-                            line_group='Área Sanitaria',
-                            color="Área Sanitaria")
-
-    fig_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
-    return fig_to_update
+        app.callback(Output('main-graph', 'figure'), figure_inputs)(update_main_figure)
+        app.callback(Output('mean7-graph', 'figure'), figure_inputs)(update_mean7_figure)
+        app.callback(Output('mean14-graph', 'figure'), figure_inputs)(update_mean14_figure)
+        app.callback(Output('exitus-graph', 'figure'), figure_inputs)(update_exitus_figure)
+        app.callback(Output('window-graph', 'figure'), window_inputs)(update_window_figure)
+
+    app.callback([Output('taboa', 'data'), Output('taboa', 'page_count')],
+                 [Input('taboa', 'page_current'), Input('taboa', 'page_size'),
+                  Input('taboa', 'sort_by'), Input('taboa', 'filter_query')])(update_table)
+
+    # Timing first, so the requests answered by serve_figure_payload are measured too
+    profiler = None
+    if PROFILE_SLOW_REQUESTS_MS:
+        profiler = instrumentation.SlowRequestProfiler(float(PROFILE_SLOW_REQUESTS_MS),
+                                                       interval_ms=float(os.environ.get('PROFILE_INTERVAL_MS', 5)),
+                                                       output_dir=os.environ.get('PROFILE_DIR', 'profiles'))
+    instrumentation.instrument_server(app.server, profiler)
+    if SNAPSHOT_DIR:
+        # Exact matches of the snapshot views are answered from files, before any other work
+        snapshots.register_snapshots(app.server, SNAPSHOT_DIR)
+        dataset_listeners.append(functools.partial(build_snapshots, app))
+    app.server.before_request(serve_figure_payload)
+    # /api/v1/...: the series as JSON or CSV, see api.py
+    register_api(app.server, get_dataset)
+
+    @app.server.route('/_metrics')
+    def prometheus_metrics():
+        # Counters, gauges and latency histograms of the worker answering, see instrumentation.py
+        return flask.Response(instrumentation.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.server.route('/_worker-memory')
+    def worker_memory():
+        # rss/pss of the worker answering, to compare the shared and per worker modes
+        return flask.jsonify(memory_usage())
+
+    if warm_up_in_background:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    return app
+
+
+app = create_app(warm_up_in_background=os.environ.get('WARM_UP', '1') == '1')
+server = app.server
 
+import_time = time.perf_counter() - import_started
+if import_time > IMPORT_TIME_BUDGET:
+    print(f'WARNING: app imported in {import_time:.2f}s, over IMPORT_TIME_BUDGET ({IMPORT_TIME_BUDGET}s)')
 
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,85 @@
+// Client side filtering mode (CLIENTSIDE_FILTERING=1): the server sends the series of the selected
+// indicator once into the 'series-store' dcc.Store, and date, area and barmode changes are
+// rendered here without a round trip.
+//
+// Store layout (see build_series_store in app.py):
+//   {version, template, colors, max_labels, max_ticks, graphs: {<graph id>: {title, kind, texttemplate,
+//    start, days: [day offsets from start], areas: [...], values: [[value per day] per area]}}}
+//
+// Days are always drawn one bar each; as in figures.bar_figure, the text labels are left out
+// above max_labels bars and the date axis has at most max_ticks ticks.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figures: (function () {
+        var DAY_MS = 86400000;
+
+        function dayString(start, offset) {
+            return new Date(Date.parse(start) + offset * DAY_MS).toISOString().slice(0, 10);
+        }
+
+        function render(store, graphId, startDate, endDate, barmode, areas) {
+            if (!store || !store.graphs || !store.graphs[graphId] || !areas || areas.length === 0) {
+                return {};
+            }
+            var graph = store.graphs[graphId];
+            var first = Math.round((Date.parse(startDate) - Date.parse(graph.start)) / DAY_MS);
+            var last = Math.round((Date.parse(endDate) - Date.parse(graph.start)) / DAY_MS);
+            var lo = 0;
+            while (lo < graph.days.length && graph.days[lo] < first) { lo++; }
+            var hi = lo;
+            while (hi < graph.days.length && graph.days[hi] <= last) { hi++; }
+            var x = graph.days.slice(lo, hi).map(function (d) { return dayString(graph.start, d); });
+
+            var shown = graph.areas.filter(function (area) { return areas.indexOf(area) !== -1; });
+            var labels = x.length * shown.length <= store.max_labels;
+
+            // Same trace order and colours as plotly express: areas in data order, colours by position
+            var traces = [];
+            graph.areas.forEach(function (area, position) {
+                if (areas.indexOf(area) === -1) { return; }
+                var y = graph.values[position].slice(lo, hi);
+                var color = store.colors[traces.length % store.colors.length];
+                var trace = {x: x, y: y, name: area, legendgroup: area, showlegend: true};
+                if (graph.kind === 'area') {
+                    Object.assign(trace, {type: 'scatter', mode: 'lines', stackgroup: '1',
+                                          line: {color: color}, fillcolor: color});
+                } else {
+                    Object.assign(trace, {type: 'bar', marker: {color: color}, offsetgroup: area});
+                    if (labels) {
+                        Object.assign(trace, {text: y, textposition: 'auto'});
+                        if (graph.texttemplate) { trace.texttemplate = graph.texttemplate; }
+                    }
+                }
+                traces.push(trace);
+            });
+
+            var layout = {
+                template: store.template,
+                title: {text: graph.title, x: 0.5},
+                legend: {title: {text: 'Área Sanitaria'}, tracegroupgap: 0},
+                yaxis: {title: {text: ''}},
+                xaxis: {title: {text: 'Data'}}
+            };
+            if (graph.kind !== 'area') {
+                layout.barmode = barmode;
+                var step = Math.max(1, Math.ceil(x.length / store.max_ticks));
+                Object.assign(layout.xaxis, {dtick: DAY_MS * step, tickformat: '%d %b', ticklabelmode: 'instant'});
+            }
+            return {data: traces, layout: layout};
+        }
+
+        return {
+            main_graph: function (store, startDate, endDate, barmode, areas) {
+                return render(store, 'main-graph', startDate, endDate, barmode, areas);
+            },
+            mean7_graph: function (store, startDate, endDate, barmode, areas) {
+                return render(store, 'mean7-graph', startDate, endDate, barmode, areas);
+            },
+            mean14_graph: function (store, startDate, endDate, barmode, areas) {
+                return render(store, 'mean14-graph', startDate, endDate, barmode, areas);
+            },
+            exitus_graph: function (store, startDate, endDate, barmode, areas) {
+                return render(store, 'exitus-graph', startDate, endDate, barmode, areas);
+            }
+        };
+    })()
+});
@@ -0,0 +1,109 @@
+# Compares the graph_objects figure builders in figures.py with the plotly express path they
+# replaced, on the ranges the app is actually asked for.
+#
+# usage: python benchmarks/bench_figures.py [repeat]
+import datetime
+import json
+import os
+import sys
+import timeit
+
+import plotly
+import plotly.express as px
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('REFRESH_INTERVAL', '0')
+os.environ.setdefault('WARM_UP', '0')
+os.environ.setdefault('FIGURE_CACHE', 'none')
+
+import app  # noqa: E402
+import figures  # noqa: E402
+
+
+# The px path as it was in app.py
+def plot_bars(df_to_figure, column, title, rb_value, texttemplate=None):
+    fig_to_update = px.bar(df_to_figure,
+                           x='Data',
+                           y=column,
+                           text=column,
+                           title=title,
+                           barmode=rb_value,
+                           color="Área Sanitaria")
+
+    fig_to_update.update_xaxes(
+        dtick=86400000.0,
+        tickformat="%d %b",
+        ticklabelmode="instant",
+        title_text='Data'
+    )
+    if texttemplate:
+        fig_to_update.update_traces(texttemplate=texttemplate)
+    fig_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
+    return fig_to_update
+
+
+def plot_exitus(df_to_figure):
+    fig_to_update = px.area(df_to_figure,
+                            x='Data',
+                            y='Falecidos Diarios',
+                            title='Falecidos Diarios',
+                            line_group='Área Sanitaria',
+                            color="Área Sanitaria")
+
+    fig_to_update.update_layout(title_x=0.5, yaxis={'title': ''})
+    return fig_to_update
+
+
+def px_view(dataset, parameter, start_date, end_date, barmode, areas):
+    start_date, end_date = app.parse_dates(start_date, end_date)
+    built = [plot_bars(dataset.cube.to_frame(start_date, end_date, areas, [parameter]),
+                       parameter, parameter, barmode)]
+    for column, title in app.MEAN_FIGURES.get(parameter, ()):
+        built.append(plot_bars(dataset.cube.to_frame(start_date, end_date, areas, [column]),
+                               column, title, barmode, texttemplate='%{text:.2f}'))
+    built.append(plot_exitus(dataset.exitus_cube.to_frame(start_date, end_date, areas, ['Falecidos Diarios'])))
+    return built
+
+
+def go_view(dataset, parameter, start_date, end_date, barmode, areas):
+    built = [figures.bar_figure(app.select(dataset.cube, start_date, end_date, areas, parameter),
+                                parameter, parameter, barmode)]
+    for column, title in app.MEAN_FIGURES.get(parameter, ()):
+        built.append(figures.bar_figure(app.select(dataset.cube, start_date, end_date, areas, column),
+                                        column, title, barmode, texttemplate='%{text:.2f}'))
+    built.append(figures.area_figure(app.select(dataset.exitus_cube, start_date, end_date, areas,
+                                                'Falecidos Diarios'),
+                                     'Falecidos Diarios', 'Falecidos Diarios'))
+    return built
+
+
+def serialized(view):
+    # What a callback pays in total: building the figures and encoding them for the response.
+    # go_view hands plain dicts to the encoder, px_view validated figure objects.
+    def run(*args):
+        return json.dumps(view(*args), cls=plotly.utils.PlotlyJSONEncoder)
+    return run
+
+
+def main(repeat=20):
+    dataset = app.get_dataset()
+    areas = list(dataset.cube.areas)
+    end = dataset.max_data
+    first = dataset.cube.days[0].astype(datetime.date)
+    parameter = 'Casos confirmados por PCR nas últimas 24 horas'
+    cases = [
+        ('default view (7 days, all areas)', end - datetime.timedelta(6), areas),
+        ('30 days, all areas', end - datetime.timedelta(29), areas),
+        ('30 days, 2 areas', end - datetime.timedelta(29), ['GALICIA', 'A.S. VIGO']),
+        ('full range, all areas', first, areas),
+    ]
+    print(f'{"case":<36}{"px ms":>10}{"go ms":>10}{"speedup":>10}')
+    for name, start, case_areas in cases:
+        args = (dataset, parameter, str(start), str(end), 'group', case_areas)
+        px_ms = min(timeit.repeat(lambda: serialized(px_view)(*args), number=1, repeat=repeat)) * 1000
+        go_ms = min(timeit.repeat(lambda: serialized(go_view)(*args), number=1, repeat=repeat)) * 1000
+        print(f'{name:<36}{px_ms:>10.1f}{go_ms:>10.1f}{px_ms / go_ms:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,25 @@
+import contextlib
+import functools
+import http.server
+import threading
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    # Plain files from a directory, 404 for the rest, without a log line per request
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_directory(directory):
+    # Stand-in for the SERGAS site on a free local port; yields the base URL
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, name='http-stub', daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_address[1]}'
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,241 @@
+# Benchmark suite: ingest, startup, metrics build and figure callbacks, on the bundled data and
+# on synthetic multi-year versions of it. Results go to a JSON file that a later run can be
+# compared against.
+#
+# usage: python benchmarks/run.py [--copies 1 3] [--repeat 5] [--stages ingest startup ...]
+#                                 [--output results.json] [--compare baseline.json]
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('REFRESH_INTERVAL', '0')
+os.environ.setdefault('WARM_UP', '0')
+os.environ.setdefault('FIGURE_CACHE', 'none')
+
+import dash  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import plotly  # noqa: E402
+
+import app  # noqa: E402
+import datastore  # noqa: E402
+import metrics  # noqa: E402
+import payloads  # noqa: E402
+from downloader import DataLoader  # noqa: E402
+
+from benchmarks.http_stub import serve_directory  # noqa: E402
+from benchmarks.synthetic import ROOT, clear_stores, write_daily_files, write_dataset  # noqa: E402
+
+STAGES = ['ingest', 'startup', 'metrics', 'figures']
+
+# Runs in a fresh interpreter inside the data directory: import time and time to the first
+# dataset, as a worker pays them
+STARTUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.get_dataset()
+print(json.dumps({'import': imported - started, 'first_dataset': time.perf_counter() - imported}))
+'''
+
+
+def measure(run, repeat, setup=None):
+    # Seconds per run; setup (not timed) runs before each of them. The code under test prints
+    # progress, which is swallowed.
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            if setup is not None:
+                setup()
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+    return times
+
+
+def summary(times):
+    return {'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+            'repeat': len(times)}
+
+
+def bench_ingest(data_dir, repeat):
+    # DataLoader.get_new_data against a local server with the per day files: catching up the
+    # last week, and downloading the whole history into an empty store
+    total_df = pd.read_csv(os.path.join(data_dir, datastore.TOTAL_DATA_CSV))
+    days = write_daily_files(os.path.join(data_dir, 'site'), total_df)
+    end_date = datetime.date.fromisoformat(days[-1])
+    cases = {'missing_7_days': days[-7], 'missing_all': None}
+    results = {}
+    with serve_directory(os.path.join(data_dir, 'site')) as base_url:
+        for case, first_missing in cases.items():
+            state = {}
+
+            def setup():
+                clear_stores(data_dir)
+                known = total_df[total_df['Fecha'] < first_missing] if first_missing else total_df.iloc[:0]
+                datastore.write_csv(known, datastore.TOTAL_DATA_CSV)
+                state['df'] = datastore.load_total_data() if len(known) else pd.DataFrame()
+
+            def run():
+                loader = DataLoader(cache_dir=None)
+                loader.data_url = base_url
+                loader.get_new_data(state['df'], end_date)
+
+            results[f'ingest.{case}'] = measure(run, repeat, setup)
+    # Leave the data directory as write_dataset made it
+    datastore.write_csv(total_df, datastore.TOTAL_DATA_CSV)
+    clear_stores(data_dir)
+    return results
+
+
+def bench_startup(data_dir, repeat):
+    # Cold: nothing derived from the CSVs yet (first deploy). Warm: stores and metrics cache
+    # from a previous run are there (a worker restart).
+    env = dict(os.environ, PYTHONPATH=ROOT, WARM_UP='0', REFRESH_INTERVAL='0')
+    results = {}
+    for case in ('cold', 'warm'):
+        timings = []
+        for _ in range(repeat):
+            if case == 'cold':
+                clear_stores(data_dir)
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], cwd=data_dir, env=env,
+                                    check=True, capture_output=True, text=True).stdout
+            timings.append(json.loads(output.strip().splitlines()[-1]))
+        results[f'startup.import.{case}'] = [t['import'] for t in timings]
+        results[f'startup.first_dataset.{case}'] = [t['first_dataset'] for t in timings]
+    return results
+
+
+def bench_metrics(data_dir, repeat):
+    dataset = app.build_dataset()
+    return {
+        'metrics.compute_metrics': measure(lambda: metrics.compute_metrics(dataset.main_df), repeat),
+        'metrics.compute_exitus_metrics':
+            measure(lambda: metrics.compute_exitus_metrics(dataset.activos_curados_falecidos_df), repeat),
+        # Stores in place, no metrics cache: what a refresh with a new data version costs
+        'metrics.build_dataset': measure(app.build_dataset, repeat,
+                                         setup=lambda: shutil.rmtree(os.path.join(data_dir, 'metrics_cache'),
+                                                                     ignore_errors=True)),
+    }
+
+
+def bench_figures(data_dir, repeat):
+    # One view is the four graph callbacks, built and serialized as the server answers them
+    # (figure cache off). Typical: the default view; worst case: the whole history, every area,
+    # stacked, for an indicator with both mean graphs.
+    dataset = app.build_dataset()
+    areas = list(dataset.cube.areas)
+    end = dataset.max_data
+    first = dataset.cube.days[0].astype(datetime.date)
+    cases = {
+        'default_view': ('Casos confirmados por PCR nas últimas 24 horas', end - datetime.timedelta(6),
+                         'group', areas),
+        '30_days_2_areas': ('Novos positivos', end - datetime.timedelta(29), 'group', ['GALICIA', 'A.S. VIGO']),
+        'worst_case': ('Novos positivos', first, 'stack', areas),
+    }
+    results = {}
+    for case, (parameter, start, barmode, case_areas) in cases.items():
+        args = (parameter, str(start), str(end), barmode, case_areas)
+
+        def run():
+            for graph, build in app.FIGURE_BUILDERS.items():
+                payloads.build_payload(graph, 'figure', build(dataset, *args))
+
+        results[f'figures.{case}'] = measure(run, repeat)
+    return results
+
+
+BENCHMARKS = {'ingest': bench_ingest, 'startup': bench_startup, 'metrics': bench_metrics,
+              'figures': bench_figures}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plotly': plotly.__version__,
+            'dash': dash.__version__}
+
+
+def compare(results, baseline, threshold):
+    # Median of every benchmark against the baseline file; returns the names that got slower
+    # by more than threshold (1.2 = 20%)
+    regressions = []
+    print(f'\n{"benchmark":<52}{"baseline":>12}{"current":>12}{"ratio":>8}')
+    for name, current in results.items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        ratio = current['median'] / previous['median']
+        flag = '  <-- slower' if ratio > threshold else ''
+        print(f'{name:<52}{previous["median"] * 1000:>10.1f}ms{current["median"] * 1000:>10.1f}ms'
+              f'{ratio:>8.2f}{flag}')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for ingest, startup, metrics and figures')
+    parser.add_argument('--copies', type=int, nargs='+', default=[1, 3],
+                        help='data sets to run on: the bundled history repeated this many times')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='previous results file to compare the medians with')
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = {}
+    started_in = os.getcwd()
+    for copies in args.copies:
+        with tempfile.TemporaryDirectory(prefix=f'bench-{copies}x-') as data_dir:
+            write_dataset(data_dir, copies)
+            # datastore, metrics and app read and write relative to the working directory
+            os.chdir(data_dir)
+            try:
+                for stage in args.stages:
+                    print(f'[{copies}x] {stage} ...', flush=True)
+                    for name, times in BENCHMARKS[stage](data_dir, args.repeat).items():
+                        results[f'{name}[{copies}x]'] = summary(times)
+                        print(f'    {name:<44}{statistics.median(times) * 1000:>10.1f}ms', flush=True)
+            finally:
+                os.chdir(started_in)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'results': results}, f, indent=2, ensure_ascii=False)
+    print(f'Results written to {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import pandas as pd
+
+import datastore
+
+# Benchmark data sets: the bundled CSVs as they are, or their history repeated back to back
+# (copies=3 is about three years of daily data for every area), plus the per day files the
+# SERGAS site publishes, for the stand-in HTTP server.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def repeat_history(df, date_column, copies):
+    # df followed by copies - 1 copies of itself, each shifted past the end of the previous one
+    dates = pd.to_datetime(df[date_column])
+    span = (dates.max().normalize() - dates.min().normalize()) + pd.Timedelta(days=1)
+    shifted = []
+    for copy in range(copies):
+        part = df.copy()
+        part[date_column] = (dates + copy * span).dt.strftime('%Y-%m-%d %H:%M:%S' if dates.dt.hour.any()
+                                                                else '%Y-%m-%d')
+        shifted.append(part)
+    return pd.concat(shifted, ignore_index=True)
+
+
+def write_dataset(target_dir, copies=1):
+    # total_data.csv and activos_curados_falecidos.csv in target_dir, the working directory
+    # layout datastore expects
+    os.makedirs(target_dir, exist_ok=True)
+    for name in (datastore.TOTAL_DATA_CSV, datastore.ACTIVOS_CURADOS_FALECIDOS_CSV):
+        source = os.path.join(ROOT, name)
+        if copies == 1:
+            shutil.copyfile(source, os.path.join(target_dir, name))
+        else:
+            df = pd.read_csv(source)
+            repeat_history(df, 'Fecha', copies).to_csv(os.path.join(target_dir, name), index=False)
+    return target_dir
+
+
+def write_daily_files(target_dir, total_df):
+    # {date}_COVID19_Web_CifrasTotais.csv for every day of total_df, as the site serves them
+    os.makedirs(target_dir, exist_ok=True)
+    dates = pd.to_datetime(total_df['Fecha']).dt.strftime('%Y-%m-%d')
+    for day, daily_df in total_df.groupby(dates, sort=True):
+        daily_df.to_csv(os.path.join(target_dir, f'{day}_COVID19_Web_CifrasTotais.csv'), index=False)
+    return sorted(dates.unique())
+
+
+def clear_stores(data_dir):
+    # Everything the app derives from the CSVs: the next run starts cold
+    for name in (datastore.TOTAL_DATA_STORE, datastore.ACTIVOS_CURADOS_FALECIDOS_STORE,
+                 'metrics_cache', 'figure_cache', 'shared_data', 'http_cache'):
+        shutil.rmtree(os.path.join(data_dir, name), ignore_errors=True)
+    for name in ('ingestion_journal.sqlite3', 'ingestion_journal.sqlite3-wal', 'ingestion_journal.sqlite3-shm'):
+        if os.path.exists(os.path.join(data_dir, name)):
+            os.remove(os.path.join(data_dir, name))
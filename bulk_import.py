@@ -0,0 +1,132 @@
+import argparse
+import hashlib
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import datastore
+import journal
+import schemas
+from journal import IngestionJournal
+
+# Rebuilds the history from a local copy of the daily SERGAS files (a directory or a zip of
+# them) instead of downloading them one by one: the files are parsed across a process pool with
+# the same variants as DataLoader.get_new_data (CifrasTotais, else CifrasTotais_PDIA) and merged
+# into the store in a single write.
+#
+# usage: python bulk_import.py <directory or .zip> [--workers N]
+
+DAILY_VARIANTS = ['CifrasTotais', 'CifrasTotais_PDIA']
+# Files per task: one task per file would spend more on pickling than on parsing
+CHUNK_SIZE = 32
+
+
+def list_files(path):
+    # {(day, variant): name} of the SERGAS files in a directory (recursively) or zip
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    else:
+        names = [os.path.relpath(os.path.join(root, file_name), path)
+                 for root, _, file_names in os.walk(path) for file_name in file_names]
+    files = {}
+    for name in names:
+        base_name = os.path.basename(name)
+        variant = schemas.variant_of(base_name)
+        if variant is not None:
+            files[(base_name[:10], variant)] = name
+    return files
+
+
+def daily_files(files):
+    # The file get_new_data would have used for every day: CifrasTotais if there is one
+    chosen = {}
+    for (day, variant), name in sorted(files.items()):
+        if variant in DAILY_VARIANTS and (day not in chosen or
+                                          DAILY_VARIANTS.index(variant) < DAILY_VARIANTS.index(chosen[day][0])):
+            chosen[day] = (variant, name)
+    return [(day, variant, name) for day, (variant, name) in sorted(chosen.items())]
+
+
+def parse_files(path, tasks):
+    # Runs in a worker process: [(day, variant, parsed variant, df or None, sha256, error)]
+    archive = zipfile.ZipFile(path) if zipfile.is_zipfile(path) else None
+    results = []
+    try:
+        for day, variant, name in tasks:
+            if archive is not None:
+                content = archive.read(name)
+            else:
+                with open(os.path.join(path, name), 'rb') as f:
+                    content = f.read()
+            content_hash = hashlib.sha256(content).hexdigest()
+            try:
+                df, parsed_variant = schemas.parse(content, variant)
+                results.append((day, variant, parsed_variant, df, content_hash, None))
+            except ValueError as e:
+                results.append((day, variant, None, None, content_hash, str(e)))
+    finally:
+        if archive is not None:
+            archive.close()
+    return results
+
+
+def import_archive(path, max_workers=None, journal_path='ingestion_journal.sqlite3'):
+    # Returns the imported rows (stored columns, store dtypes)
+    started = time.perf_counter()
+    files = list_files(path)
+    tasks = daily_files(files)
+    chunks = [tasks[i:i + CHUNK_SIZE] for i in range(0, len(tasks), CHUNK_SIZE)]
+
+    ingestion_journal = IngestionJournal(journal_path) if journal_path else None
+    daily_dfs = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for results in executor.map(parse_files, [path] * len(chunks), chunks):
+            for day, variant, parsed_variant, df, content_hash, error in results:
+                if df is None:
+                    print(f'Unable to parse {schemas.file_name(day, variant)}: {error}')
+                    status, row_count = journal.FAILED, None
+                else:
+                    daily_dfs.append(df)
+                    status, row_count = journal.OK, len(df)
+                if ingestion_journal is not None:
+                    ingestion_journal.record(day, variant, status, variant=parsed_variant, row_count=row_count,
+                                             content_hash=content_hash)
+    parsed = time.perf_counter()
+
+    imported_df = pd.DataFrame()
+    if daily_dfs:
+        imported_df = datastore.to_schema(pd.concat(daily_dfs, ignore_index=True), datastore.TOTAL_DATA_SCHEMA)
+        datastore.merge_total_data(imported_df)
+
+    # ActivosCuradosFallecidos is cumulative: the latest file has the whole history
+    activos = sorted((day, name) for (day, variant), name in files.items() if variant == 'ActivosCuradosFallecidos')
+    if activos:
+        day, name = activos[-1]
+        results = parse_files(path, [(day, 'ActivosCuradosFallecidos', name)])
+        _, _, parsed_variant, df, content_hash, error = results[0]
+        if df is None:
+            print(f'Unable to parse {name}: {error}')
+        else:
+            datastore.write_activos_curados_falecidos(df)
+        if ingestion_journal is not None:
+            ingestion_journal.record(day, 'ActivosCuradosFallecidos', journal.FAILED if df is None else journal.OK,
+                                     variant=parsed_variant, row_count=None if df is None else len(df),
+                                     content_hash=content_hash)
+
+    if ingestion_journal is not None:
+        ingestion_journal.close()
+    print(f'Imported {len(daily_dfs)} days ({len(imported_df)} rows) from {path}: '
+          f'parsed in {parsed - started:.2f}s, stored in {time.perf_counter() - parsed:.2f}s')
+    return imported_df
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import a directory or zip of daily SERGAS files into the store')
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=None, help='parser processes (default: one per CPU)')
+    args = parser.parse_args()
+    import_archive(args.path, max_workers=args.workers)
@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+AREA = 'Área Sanitaria'
+
+
+class DataCube:
+    # Dense [day, area, metric] float32 array built from a long (date, area) frame.
+    # days is sorted, so a date range is two binary searches and a slice, and areas are picked
+    # with fancy indexing through area_positions: no per-row Python comparisons on the hot path.
+
+    def __init__(self, df, date_column='Data'):
+        day_values = pd.to_datetime(df[date_column]).to_numpy().astype('datetime64[D]')
+        day_codes, days = pd.factorize(day_values, sort=True)
+        area_codes, areas = pd.factorize(df[AREA].astype(str))
+
+        self.days = np.asarray(days, dtype='datetime64[D]')
+        # Areas in order of first appearance, the order the figures draw them in
+        self.areas = list(areas)
+        self.area_positions = {area: position for position, area in enumerate(self.areas)}
+        self.metrics = [c for c in df.columns if c not in (date_column, AREA) and
+                        pd.api.types.is_numeric_dtype(df[c])]
+        self.metric_positions = {metric: position for position, metric in enumerate(self.metrics)}
+
+        self.values = np.full((len(self.days), len(self.areas), len(self.metrics)), np.nan, dtype='float32')
+        self.values[day_codes, area_codes] = df[self.metrics].to_numpy(dtype='float32')
+        # Which (day, area) cells had a row at all
+        self.present = np.zeros((len(self.days), len(self.areas)), dtype=bool)
+        self.present[day_codes, area_codes] = True
+
+    def save(self, path):
+        # Plain .npy files, so other processes can np.load(mmap_mode='r') them
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'values.npy'), self.values)
+        np.save(os.path.join(path, 'present.npy'), self.present)
+        np.save(os.path.join(path, 'days.npy'), self.days)
+        with open(os.path.join(path, 'labels.json'), 'w', encoding='utf-8') as f:
+            json.dump({'areas': self.areas, 'metrics': self.metrics}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # With mmap the arrays are read-only views of the page cache, shared by every process
+        # that maps the same files
+        mmap_mode = 'r' if mmap else None
+        cube = cls.__new__(cls)
+        cube.values = np.load(os.path.join(path, 'values.npy'), mmap_mode=mmap_mode)
+        cube.present = np.load(os.path.join(path, 'present.npy'), mmap_mode=mmap_mode)
+        cube.days = np.load(os.path.join(path, 'days.npy'))
+        with open(os.path.join(path, 'labels.json'), encoding='utf-8') as f:
+            labels = json.load(f)
+        cube.areas = labels['areas']
+        cube.area_positions = {area: position for position, area in enumerate(cube.areas)}
+        cube.metrics = labels['metrics']
+        cube.metric_positions = {metric: position for position, metric in enumerate(cube.metrics)}
+        return cube
+
+    def day_range(self, start_date, end_date):
+        start = np.searchsorted(self.days, np.datetime64(start_date, 'D'), side='left')
+        end = np.searchsorted(self.days, np.datetime64(end_date, 'D'), side='right')
+        return slice(start, end)
+
+    def area_indices(self, areas):
+        return np.array(sorted(self.area_positions[area] for area in areas if area in self.area_positions),
+                        dtype=int)
+
+    def select(self, start_date, end_date, areas, metrics):
+        # values[days, areas, metrics] for the range and areas, plus the matching labels
+        days = self.day_range(start_date, end_date)
+        area_indices = self.area_indices(areas)
+        metric_indices = [self.metric_positions[metric] for metric in metrics]
+        values = self.values[days][:, area_indices][:, :, metric_indices]
+        present = self.present[days][:, area_indices]
+        return self.days[days], [self.areas[i] for i in area_indices], values, present
+
+    def to_frame(self, start_date, end_date, areas, metrics, date_column='Data'):
+        # Long (date, area) frame of the selection, for plotly express
+        days, area_names, values, present = self.select(start_date, end_date, areas, metrics)
+        n_days, n_areas = present.shape
+        frame = pd.DataFrame({date_column: np.repeat(days, n_areas).astype('datetime64[ns]'),
+                              AREA: np.tile(np.array(area_names, dtype=object), n_days)})
+        # float32 -> float64 shows e.g. 0.1 as 0.10000000149; 4 decimals is beyond what is displayed
+        flat_values = values.reshape(n_days * n_areas, len(metrics)).astype('float64').round(4)
+        for position, metric in enumerate(metrics):
+            frame[metric] = flat_values[:, position]
+        return frame[present.reshape(-1)].reset_index(drop=True)
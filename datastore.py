@@ -0,0 +1,205 @@
+import glob
+import os
+
+import pandas as pd
+
+# Typed, columnar copies of the Sergas data. The csv files are kept as an export
+# (and as the source the store is rebuilt from when it is missing or older).
+TOTAL_DATA_CSV = 'total_data.csv'
+TOTAL_DATA_STORE = 'total_data.parquet'
+ACTIVOS_CURADOS_FALECIDOS_CSV = 'activos_curados_falecidos.csv'
+ACTIVOS_CURADOS_FALECIDOS_STORE = 'activos_curados_falecidos.parquet'
+
+TOTAL_DATA_SCHEMA = {
+    'Fecha': 'datetime64[ns]',
+    'Area_Sanitaria': 'category',
+    'Casos_Totais': 'int32',
+    'Casos_Confirmados_PCR_Ultimas24h': 'int32',
+    'Pacientes_Sin_Alta': 'int32',
+    'Pacientes_Con_Alta': 'int32',
+    'Camas_Ocupadas_HOS': 'int32',
+    'Camas_Ocupadas_UCI': 'int32',
+    'Probas_Realizadas_PCR': 'int32',
+    'Probas_Realizadas_Non_PCR': 'int32',
+    'Exitus': 'int32'
+}
+
+ACTIVOS_CURADOS_FALECIDOS_SCHEMA = {
+    'Fecha': 'datetime64[ns]',
+    'Area_Sanitaria': 'category',
+    'Pacientes_Sin_Alta': 'int32',
+    'Pacientes_Con_Alta': 'int32',
+    'Exitus': 'int32'
+}
+
+# Appends are written as new part files; past this many parts the store is compacted
+MAX_PARTS = 32
+
+
+def write_csv(df, path):
+    # Write the whole file to a temporary sibling and swap it in, so a crash never
+    # leaves a truncated csv behind
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def append_csv(df, path):
+    # Append only the new rows. If anything fails halfway the file is truncated back
+    # to its previous size, so readers never see a partially written day.
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        write_csv(df, path)
+        return
+
+    with open(path, 'rb') as f:
+        header = f.readline().decode('utf-8').strip().split(',')
+    payload = df.reindex(columns=header).to_csv(index=False, header=False).encode('utf-8')
+
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        committed_size = f.tell()
+        try:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(committed_size)
+            raise
+
+
+def to_schema(df, schema):
+    df = df[list(schema)].copy()
+    df['Fecha'] = pd.to_datetime(df['Fecha'])
+    return df.astype(schema)
+
+
+def store_parts(store_path):
+    return sorted(glob.glob(os.path.join(store_path, 'part-*.parquet')))
+
+
+def write_part(df, store_path, part_number):
+    os.makedirs(store_path, exist_ok=True)
+    part_path = os.path.join(store_path, f'part-{part_number:06d}.parquet')
+    # One temporary file per process: every gunicorn worker may rebuild a missing store at once
+    tmp_path = f"{part_path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, part_path)
+
+
+def write_store(df, store_path, schema):
+    # Compacted write: everything goes into part 0, then the old parts are dropped.
+    # A crash in between only leaves duplicated rows, which read_store removes.
+    old_parts = store_parts(store_path)
+    write_part(to_schema(df, schema), store_path, 0)
+    for part_path in old_parts[1:]:
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            # Removed by another process compacting the same store
+            pass
+
+
+def append_store(df, store_path, schema):
+    parts = store_parts(store_path)
+    next_part = int(os.path.basename(parts[-1])[5:11]) + 1 if parts else 0
+    write_part(to_schema(df, schema), store_path, next_part)
+    if len(parts) + 1 > MAX_PARTS:
+        write_store(read_store(store_path, schema), store_path, schema)
+
+
+def read_store(store_path, schema):
+    df = pd.concat([pd.read_parquet(part_path) for part_path in store_parts(store_path)], ignore_index=True)
+    # Categories may differ between parts, so the schema is applied after concatenating
+    df = df.drop_duplicates(subset=['Fecha', 'Area_Sanitaria'], keep='last', ignore_index=True)
+    return df.astype(schema)
+
+
+def is_fresh(store_path, csv_path):
+    parts = store_parts(store_path)
+    if not parts:
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    return max(os.path.getmtime(part_path) for part_path in parts) >= os.path.getmtime(csv_path)
+
+
+def load(store_path, csv_path, schema):
+    if is_fresh(store_path, csv_path):
+        return read_store(store_path, schema)
+
+    # No store yet (or the csv was updated by hand / git): rebuild it from the csv
+    df = to_schema(pd.read_csv(csv_path), schema)
+    try:
+        write_store(df, store_path, schema)
+    except OSError as e:
+        # Another process rebuilding it at the same time: the store it wrote is as good
+        print(f'Rebuilding {store_path} failed ({e!r}), reading it back')
+        return read_store(store_path, schema)
+    return df
+
+
+class Appender:
+    # Appends frames one by one: each is durable in the csv once append() returns, the store is
+    # updated once on exit. If the process dies in between, the csv is ahead of the store and
+    # the next load() rebuilds the store from it, so nothing appended is lost either way.
+
+    def __init__(self, store_path, csv_path, schema):
+        self.store_path = store_path
+        self.csv_path = csv_path
+        self.schema = schema
+        self.dfs = []
+
+    def __enter__(self):
+        self.store_was_fresh = is_fresh(self.store_path, self.csv_path)
+        return self
+
+    def append(self, df):
+        append_csv(df, self.csv_path)
+        self.dfs.append(df)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.dfs:
+            return
+        if self.store_was_fresh:
+            append_store(pd.concat(self.dfs, ignore_index=True), self.store_path, self.schema)
+        else:
+            load(self.store_path, self.csv_path, self.schema)
+
+
+def load_total_data():
+    return load(TOTAL_DATA_STORE, TOTAL_DATA_CSV, TOTAL_DATA_SCHEMA)
+
+
+def load_total_data_metadata():
+    # Last date and areas (in order of appearance) reading only those two columns
+    columns = ['Fecha', 'Area_Sanitaria']
+    if is_fresh(TOTAL_DATA_STORE, TOTAL_DATA_CSV):
+        df = pd.concat([pd.read_parquet(part_path, columns=columns) for part_path in store_parts(TOTAL_DATA_STORE)])
+    else:
+        df = pd.read_csv(TOTAL_DATA_CSV, usecols=columns)
+    return pd.to_datetime(df['Fecha']).max().date(), list(pd.unique(df['Area_Sanitaria'].astype(str)))
+
+
+def total_data_appender():
+    return Appender(TOTAL_DATA_STORE, TOTAL_DATA_CSV, TOTAL_DATA_SCHEMA)
+
+
+def merge_total_data(df):
+    # Merges df (in TOTAL_DATA_SCHEMA) with what is stored, df winning for the (day, area) rows
+    # both have, and rewrites the csv and the store once
+    if store_parts(TOTAL_DATA_STORE) or os.path.exists(TOTAL_DATA_CSV):
+        df = pd.concat([load_total_data(), df], ignore_index=True)
+    day = df['Fecha'].dt.normalize()
+    df = df[~pd.DataFrame({'day': day, 'area': df['Area_Sanitaria']}).duplicated(keep='last')]
+    df = to_schema(df.sort_values('Fecha', kind='mergesort').reset_index(drop=True), TOTAL_DATA_SCHEMA)
+    write_csv(df, TOTAL_DATA_CSV)
+    write_store(df, TOTAL_DATA_STORE, TOTAL_DATA_SCHEMA)
+
+
+def load_activos_curados_falecidos():
+    return load(ACTIVOS_CURADOS_FALECIDOS_STORE, ACTIVOS_CURADOS_FALECIDOS_CSV, ACTIVOS_CURADOS_FALECIDOS_SCHEMA)
+
+
+def write_activos_curados_falecidos(df):
+    write_csv(df, ACTIVOS_CURADOS_FALECIDOS_CSV)
+    write_store(df, ACTIVOS_CURADOS_FALECIDOS_STORE, ACTIVOS_CURADOS_FALECIDOS_SCHEMA)
@@ -1,87 +1,180 @@
 import requests
 import json
 import pandas as pd
-import io
+import os
 import datetime
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import datastore
+import journal
+import schemas
+from journal import IngestionJournal
+from response_cache import CachedResponse, ResponseCache
+
+# Days that came back 404 in every variant are probed again until they are this old; after
+# that the journal settles them as gaps
+RECHECK_DAYS = 7
 
 
 class DataLoader:
 
-    def __init__(self):
+    def __init__(self, max_workers=8, max_per_host=8, retries=3, backoff_factor=0.5,
+                 cache_dir='http_cache', negative_ttl=datetime.timedelta(hours=6),
+                 journal_path='ingestion_journal.sqlite3'):
         self.config_url = 'https://coronavirus.sergas.gal/datos/libs/hot-config/hot-config.txt'
         self.data_url = 'https://coronavirus.sergas.gal/infodatos'
+        self.max_workers = max_workers
+        self.session = self.build_session(max_per_host, retries, backoff_factor)
+        # cache_dir=None disables the response cache
+        self.cache = ResponseCache(cache_dir, negative_ttl) if cache_dir else None
+        # journal_path=None disables the ingestion journal
+        self.journal = IngestionJournal(journal_path) if journal_path else None
+
+    @staticmethod
+    def build_session(max_per_host, retries, backoff_factor):
+        # One pooled session shared by every worker thread. The pool blocks when
+        # max_per_host connections to the same host are in use, so the Sergas
+        # server never sees more than that many concurrent requests from us.
+        retry = Retry(total=retries,
+                      backoff_factor=backoff_factor,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=max_per_host,
+                              pool_block=True,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def fetch(self, url):
+        if self.cache is None:
+            response = self.session.get(url)
+            return CachedResponse(response.status_code, response.content, True)
+        return self.cache.get(self.session, url)
 
     def get_config(self):
 
         # Configuration url for data at Sergas
 
-        response_content = requests.get(self.config_url).content
+        response_content = self.fetch(self.config_url).content
         json_content = json.loads(response_content)
         url_list = [a_source['URL'] for a_source in json_content['DATA_SOURCE']['FILES']]
         print("\n".join(url_list))
         return url_list
 
+    def record(self, a_date, source, response, variant=None, row_count=None):
+        # Journal entry for a fetch that did not produce stored data (those are recorded by the
+        # caller once the data is on disk)
+        if self.journal is None:
+            return
+        if response.status_code == requests.codes.not_found:
+            status = journal.NOT_FOUND
+        elif response.status_code == requests.codes.ok:
+            status = journal.OK
+        else:
+            status = journal.FAILED
+        self.journal.record(a_date, source, status, http_status=response.status_code, variant=variant,
+                            row_count=row_count, content_hash=hashlib.sha256(response.content).hexdigest()
+                            if status == journal.OK else None)
+
+    def parse(self, a_date, source, response):
+        # (dataframe, variant) of a 200 response through the schema registry; (None, None) when
+        # the file does not match its variant, journaled as failed so later runs retry it
+        try:
+            return schemas.parse(response.content, source)
+        except (schemas.SchemaDriftError, ValueError) as e:
+            print(f'Unable to parse {schemas.file_name(a_date, source)}: {e}')
+            if self.journal is not None:
+                self.journal.record(a_date, source, journal.FAILED, http_status=response.status_code,
+                                    content_hash=hashlib.sha256(response.content).hexdigest())
+            return None, None
+
+    def fetch_daily_data(self, a_date):
+        # (dataframe, source, variant, response) for a_date ('YYYY-MM-DD'); dataframe is None if
+        # the day is not available. Misses are journaled here, successes by get_new_data once
+        # stored. CifrasTotais is tried first, then CifrasTotais_PDIA.
+        print(f"Non-existent: {a_date} data in DF. Trying to add it ...")
+        for source in ('CifrasTotais', 'CifrasTotais_PDIA'):
+            response = self.fetch(f"{self.data_url}/{schemas.file_name(a_date, source)}")
+            if response.status_code == requests.codes.ok:  # i.e status = 200
+                df, variant = self.parse(a_date, source, response)
+                return df, source, variant, response
+            print(f'Content for {schemas.file_name(a_date, source)} not available. '
+                  f'Status code: {response.status_code}')
+            self.record(a_date, source, response)
+            if response.status_code != requests.codes.not_found:
+                break
+        return None, None, None, response
+
+    def settled_gaps(self, end_date):
+        # Days old enough that 404 in every variant means the site will never have them
+        if self.journal is None:
+            return set()
+        recheck_from = str(pd.Timestamp(end_date).date() - datetime.timedelta(RECHECK_DAYS))
+        return {day for day in self.journal.days(journal.NOT_FOUND, ['CifrasTotais', 'CifrasTotais_PDIA'])
+                if day < recheck_from}
+
     def get_new_data(self, df, end_date):
 
         start_date = '2020-10-07'
         # start_date = '2021-05-25'
         if df.empty:
-            unique_data = ''
+            known_dates = set()
         else:
-            unique_data = [x.split()[0] for x in df['Fecha'].unique()]
-
-        for some_date in pd.date_range(start=start_date, end=end_date):
-            a_date = str(some_date.date())
-            if a_date not in unique_data:
-                print(f"Non-existent: {a_date} data in DF. Trying to add it ...")
-                daily_url = f"{self.data_url}/{a_date}_COVID19_Web_CifrasTotais.csv"
-                response = requests.get(daily_url)
-
-                if response.status_code == requests.codes.ok:  # i.e status = 200
-                    daily_df = pd.read_csv(io.StringIO(response.content.decode('utf-8')), thousands='.', decimal=',')
-                    df = pd.concat([df, daily_df], ignore_index=True)
-                elif response.status_code == requests.codes.not_found:  # i.e status = 404
-                    print(
-                        f'Content for {a_date}_COVID19_Web_CifrasTotais.csv not available. Status code: {response.status_code}')
-
-                    daily_url = f"{self.data_url}/{a_date}_COVID19_Web_CifrasTotais_PDIA.csv"
-                    response = requests.get(daily_url)
-                    if response.status_code == requests.codes.ok:  # i.e status = 200
-                        daily_df_pdia = pd.read_csv(io.StringIO(response.content.decode('utf-8')), thousands='.',
-                                               decimal=',')
-                        # remove last column
-                        del daily_df_pdia['Probas_Antixenos_Realizadas']
-                        # rename
-                        daily_df_pdia.rename(columns={
-                            'Probas_Realizadas_Non_PDIA': 'Probas_Realizadas_Non_PCR',
-                            'Casos_Confirmados_PDIA_Ultimas24h': 'Casos_Confirmados_PCR_Ultimas24h'
-                        },
-                            inplace=True)
-
-                        df = pd.concat([df, daily_df_pdia], ignore_index=True)
-                    else:
-                        print(f'Content for {a_date}_COVID19_Web_CifrasTotais_PDIA.csv not available. Status code: {response.status_code}')
-                else:
-                    print(f'Content for {a_date} not available. Status code: {response.status_code}')
-
-            else:
-                pass
-
-        df.to_csv('total_data.csv', index=False)
+            # Days are formatted once per distinct value, not once per row
+            known_dates = set(pd.DatetimeIndex(pd.to_datetime(df['Fecha']).unique()).strftime('%Y-%m-%d'))
+        # Known gaps are not probed again; the stored data, not the journal, says what we have
+        known_dates |= self.settled_gaps(end_date)
+
+        missing_dates = [some_date for some_date in pd.date_range(start=start_date, end=end_date).strftime('%Y-%m-%d')
+                         if some_date not in known_dates]
+
+        # Fetch every missing day concurrently. map() keeps the input order, so the days are
+        # still appended in date order whatever order they complete in. Each day is committed
+        # (csv, then journal) as soon as it is its turn, so an interrupted run resumes after the
+        # last committed day.
+        daily_dfs = []
+        with datastore.total_data_appender() as appender, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for a_date, (daily_df, source, variant, response) in zip(missing_dates,
+                                                                     executor.map(self.fetch_daily_data,
+                                                                                  missing_dates)):
+                if daily_df is None:
+                    continue
+                appender.append(daily_df)
+                self.record(a_date, source, response, variant=variant, row_count=len(daily_df))
+                daily_dfs.append(daily_df)
+
+        new_df = pd.concat(daily_dfs, ignore_index=True) if daily_dfs else pd.DataFrame()
+        if not new_df.empty:
+            print(f"Added {len(daily_dfs)} days ({len(new_df)} rows) to {datastore.TOTAL_DATA_STORE}")
+        return new_df
 
     def get_activos_curados_falecidos(self, a_day):
         yesterday = a_day-datetime.timedelta(1)
         yesterday_str = yesterday.strftime('%Y-%m-%d')
-        activos_curados_falecidos_url = f"{self.data_url}/{yesterday_str}_COVID19_Web_ActivosCuradosFallecidos.csv"
-        response = requests.get(activos_curados_falecidos_url)
-
-        if response.status_code == requests.codes.ok:  # i.e status = 200
-            activos_curados_falecidos_df = pd.read_csv(io.StringIO(response.content.decode('utf-8')), thousands='.',
-                                                       decimal=',')
-
-            activos_curados_falecidos_df.to_csv('activos_curados_falecidos.csv', index=False)
+        activos_curados_falecidos_url = f"{self.data_url}/{schemas.file_name(yesterday_str, 'ActivosCuradosFallecidos')}"
+        response = self.fetch(activos_curados_falecidos_url)
+
+        if response.status_code == requests.codes.ok and not response.changed \
+                and os.path.exists(datastore.ACTIVOS_CURADOS_FALECIDOS_CSV):
+            print('activos_curados_falecidos unchanged')
+        elif response.status_code == requests.codes.ok:  # i.e status = 200
+            activos_curados_falecidos_df, variant = self.parse(yesterday_str, 'ActivosCuradosFallecidos', response)
+            if activos_curados_falecidos_df is None:
+                return
+
+            datastore.write_activos_curados_falecidos(activos_curados_falecidos_df)
+            self.record(yesterday_str, 'ActivosCuradosFallecidos', response, variant=variant,
+                        row_count=len(activos_curados_falecidos_df))
             print('GOT activos_curados_falecidos')
         else:
+            self.record(yesterday_str, 'ActivosCuradosFallecidos', response)
             print('Unable to get activos_curados_falecidos')
 
 
@@ -89,7 +182,7 @@ if __name__ == '__main__':
 
     today = datetime.date.today()
     try:
-        main_df = pd.read_csv('total_data.csv')
+        main_df = datastore.load_total_data()
     except Exception as e:
         print(f"Exception {e.__cause__}")
         main_df = pd.DataFrame()
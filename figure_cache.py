@@ -0,0 +1,87 @@
+import glob
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+import cachetools
+
+import instrumentation
+
+
+class FigureCache:
+    # Figures built by the callbacks, keyed by the dataset version plus the callback inputs.
+    # Backends:
+    # - 'memory': per-process LRU of at most max_entries
+    # - 'filesystem': pickle files in cache_dir shared by every gunicorn worker, the least recently
+    #   used beyond max_entries are removed
+    # - 'none': no caching
+
+    def __init__(self, backend='memory', max_entries=128, cache_dir='figure_cache'):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.memory = cachetools.LRUCache(maxsize=max_entries)
+        if backend == 'filesystem':
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key_hash(version, key):
+        return hashlib.sha1(json.dumps([version, key]).encode('utf-8')).hexdigest()
+
+    def get_or_build(self, version, key, build):
+        if self.backend == 'memory':
+            with self.lock:
+                value = self.memory.get((version, key))
+            instrumentation.CACHE_LOOKUPS.inc(cache='figures', result='miss' if value is None else 'hit')
+            if value is None:
+                value = build()
+                with self.lock:
+                    self.memory[(version, key)] = value
+            return value
+
+        if self.backend == 'filesystem':
+            # The version is part of the file name so invalidate() can drop old versions
+            path = os.path.join(self.cache_dir, f'{version}-{self.key_hash(version, key)}.pkl')
+            try:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+                os.utime(path)
+                instrumentation.CACHE_LOOKUPS.inc(cache='figures', result='hit')
+                return value
+            except (OSError, EOFError, pickle.UnpicklingError):
+                instrumentation.CACHE_LOOKUPS.inc(cache='figures', result='miss')
+            value = build()
+            tmp_path = f'{path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self.evict()
+            return value
+
+        return build()
+
+    def evict(self):
+        paths = glob.glob(os.path.join(self.cache_dir, '*.pkl'))
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.max_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, version):
+        # Drops every figure not built from the given dataset version
+        with self.lock:
+            self.memory.clear()
+        if self.backend == 'filesystem':
+            for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+                if not os.path.basename(path).startswith(f'{version}-'):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
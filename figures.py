@@ -0,0 +1,111 @@
+import numpy as np
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from aggregation import MAX_LABELS, MAX_TICKS
+
+AREA = 'Área Sanitaria'
+# The colour sequence plotly express takes from the template
+COLORS = list(pio.templates['plotly'].layout.colorway)
+DAY_MS = 86400000.0
+# Date axis title (and hover label) by granularity, see aggregation.py
+X_TITLES = {'day': 'Data', 'week': 'Semana', 'month': 'Mes'}
+
+# Layouts are validated (template included) once, here. Figures are returned as plain dicts that
+# share them: building go.Bar/go.Figure objects validates every property of every trace again on
+# each call, which is most of what px spends its time on too.
+BAR_LAYOUT = go.Layout(template='plotly',
+                       xaxis={'anchor': 'y', 'domain': [0.0, 1.0],
+                              'title': {'text': 'Data'},
+                              'dtick': DAY_MS,
+                              'tickformat': '%d %b',
+                              'ticklabelmode': 'instant'},
+                       yaxis={'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': ''}},
+                       legend={'title': {'text': AREA}, 'tracegroupgap': 0},
+                       title={'x': 0.5}).to_plotly_json()
+AREA_LAYOUT = go.Layout(template='plotly',
+                        xaxis={'anchor': 'y', 'domain': [0.0, 1.0], 'title': {'text': 'Data'}},
+                        yaxis={'anchor': 'x', 'domain': [0.0, 1.0], 'title': {'text': ''}},
+                        legend={'title': {'text': AREA}, 'tracegroupgap': 0},
+                        title={'x': 0.5}).to_plotly_json()
+
+
+def area_series(selection):
+    # (area, x, y) for every area of a DataCube.select() selection of one metric, skipping days
+    # without a row for the area. Days go out as 'YYYY-MM-DD' whichever JSON encoder serializes them.
+    days, areas, values, present = selection
+    days = np.datetime_as_string(days)
+    # float32 -> float64 shows e.g. 0.1 as 0.10000000149; 4 decimals is beyond what is displayed
+    values = values[:, :, 0].astype('float64').round(4)
+    for position, area in enumerate(areas):
+        rows = present[:, position]
+        yield area, days[rows], values[rows, position]
+
+
+def date_axis(layout, days, granularity):
+    # At most MAX_TICKS ticks whatever the range: every k days, weeks or months
+    n_periods = len(days)
+    step = max(1, -(-n_periods // MAX_TICKS))
+    xaxis = {**layout['xaxis'], 'title': {'text': X_TITLES[granularity]}}
+    if granularity == 'month':
+        xaxis.update({'dtick': f'M{step}', 'tickformat': '%b %Y'})
+    elif granularity == 'week':
+        xaxis.update({'dtick': 7 * DAY_MS * step, 'tickformat': '%d %b'})
+    elif 'dtick' in xaxis:
+        xaxis['dtick'] = DAY_MS * step
+    return xaxis
+
+
+def bar_figure(selection, column, title, barmode, texttemplate=None, granularity='day'):
+    # The figure px.bar(x='Data', y=column, text=column, color='Área Sanitaria') draws, with one
+    # bar trace per area straight from the selected arrays. Over MAX_LABELS bars the text labels
+    # are left out: the browser would not fit them anyway.
+    series = list(area_series(selection))
+    labels = sum(len(x) for _, x, _ in series) <= MAX_LABELS
+    x_title = X_TITLES[granularity]
+    traces = []
+    for position, (area, x, y) in enumerate(series):
+        trace = {'type': 'bar',
+                 'x': x, 'y': y,
+                 'name': area,
+                 'legendgroup': area,
+                 'offsetgroup': area,
+                 'alignmentgroup': 'True',
+                 'marker': {'color': COLORS[position % len(COLORS)]},
+                 'orientation': 'v',
+                 'showlegend': True,
+                 'xaxis': 'x',
+                 'yaxis': 'y'}
+        if labels:
+            trace.update({'text': y, 'textposition': 'auto',
+                          'hovertemplate': f'{AREA}={area}<br>{x_title}=%{{x}}<br>{column}=%{{text}}<extra></extra>'})
+            if texttemplate:
+                trace['texttemplate'] = texttemplate
+        else:
+            trace['hovertemplate'] = f'{AREA}={area}<br>{x_title}=%{{x}}<br>{column}=%{{y}}<extra></extra>'
+        traces.append(trace)
+    return {'data': traces,
+            'layout': {**BAR_LAYOUT, 'title': {**BAR_LAYOUT['title'], 'text': title}, 'barmode': barmode,
+                       'xaxis': date_axis(BAR_LAYOUT, selection[0], granularity)}}
+
+
+def area_figure(selection, column, title, granularity='day'):
+    # Stacked area chart, as px.area(x='Data', y=column, line_group/color='Área Sanitaria')
+    traces = []
+    for position, (area, x, y) in enumerate(area_series(selection)):
+        traces.append({'type': 'scatter',
+                       'x': x, 'y': y,
+                       'name': area,
+                       'legendgroup': area,
+                       'line': {'color': COLORS[position % len(COLORS)]},
+                       'mode': 'lines',
+                       'stackgroup': '1',
+                       'hovertemplate': f'{AREA}={area}<br>{X_TITLES[granularity]}=%{{x}}<br>{column}=%{{y}}'
+                                        '<extra></extra>',
+                       'orientation': 'v',
+                       'showlegend': True,
+                       'xaxis': 'x',
+                       'yaxis': 'y'})
+    return {'data': traces,
+            'layout': {**AREA_LAYOUT, 'title': {**AREA_LAYOUT['title'], 'text': title},
+                       'xaxis': {**AREA_LAYOUT['xaxis'], 'title': {'text': X_TITLES[granularity]}}}}
@@ -0,0 +1,287 @@
+import bisect
+import collections
+import contextlib
+import os
+import re
+import sys
+import threading
+import time
+
+import flask
+
+# Counters, gauges and latency histograms of this process, rendered in the Prometheus text
+# format by render(). Every gunicorn worker keeps its own: scrape them one by one (the pid is
+# in the output) or run a single worker.
+#
+# Opt-in sampling profiler for slow requests: with PROFILE_SLOW_REQUESTS_MS set, the stack of
+# every request thread is sampled every PROFILE_INTERVAL_MS and the requests slower than the
+# threshold are written to PROFILE_DIR as collapsed stacks ("frame;frame;frame count" lines,
+# the input of flamegraph.pl or speedscope).
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99)
+# Quantiles are computed over the last RECENT observations of every series
+RECENT = 1024
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+
+    def label_key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.label_names)
+
+    def header(self, kind):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {kind}']
+
+
+class Counter(Metric):
+
+    def __init__(self, name, documentation, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self.values = collections.defaultdict(int)
+
+    def inc(self, amount=1, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] += amount
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        return self.header('counter') + [f'{self.name}{format_labels(key)} {format_value(value)}'
+                                         for key, value in sorted(values.items())]
+
+
+class Gauge(Metric):
+    # Values are read when rendering: function() returns a number, or a list of
+    # ({label: value}, number) pairs for labelled gauges, or None when there is nothing to report
+
+    def __init__(self, name, documentation, function, label_names=()):
+        super().__init__(name, documentation, label_names)
+        self.function = function
+
+    def render(self):
+        try:
+            values = self.function()
+        except Exception as e:
+            return [f'# {self.name} unavailable: {e!r}']
+        if values is None:
+            return []
+        if not isinstance(values, list):
+            values = [({}, values)]
+        return self.header('gauge') + [f'{self.name}{format_labels(self.label_key(labels))} {format_value(value)}'
+                                       for labels, value in values]
+
+
+class Histogram(Metric):
+    # Cumulative buckets as Prometheus expects them, plus a {name}_recent summary with the
+    # QUANTILES of the last RECENT observations (p50/p99 without a Prometheus server)
+
+    def __init__(self, name, documentation, label_names=(), buckets=BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value, **labels):
+        key = self.label_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0,
+                                             'recent': collections.deque(maxlen=RECENT)}
+            position = bisect.bisect_left(self.buckets, value)
+            if position < len(self.buckets):
+                series['buckets'][position] += 1
+            series['sum'] += value
+            series['count'] += 1
+            series['recent'].append(value)
+
+    def render(self):
+        with self.lock:
+            series = {key: {'buckets': list(s['buckets']), 'sum': s['sum'], 'count': s['count'],
+                            'recent': sorted(s['recent'])} for key, s in self.series.items()}
+        lines = self.header('histogram')
+        for key, s in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, s['buckets']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(key, [("le", format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(key, [("le", "+Inf")])} {s["count"]}')
+            lines.append(f'{self.name}_sum{format_labels(key)} {format_value(s["sum"])}')
+            lines.append(f'{self.name}_count{format_labels(key)} {s["count"]}')
+        lines += [f'# HELP {self.name}_recent {self.documentation} (last {RECENT} observations)',
+                  f'# TYPE {self.name}_recent summary']
+        for key, s in sorted(series.items()):
+            recent = s['recent']
+            for quantile in QUANTILES:
+                value = recent[min(int(quantile * len(recent)), len(recent) - 1)]
+                lines.append(f'{self.name}_recent{format_labels(key, [("quantile", quantile)])} {format_value(value)}')
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+STEP_SECONDS = register(Histogram('covid_step_seconds',
+                                  'Duration of data loading, derived metric and filtering steps', ['step']))
+FIGURE_SECONDS = register(Histogram('covid_figure_seconds',
+                                    'Duration of building (filtering included) and serializing a figure',
+                                    ['graph', 'phase']))
+CALLBACK_SECONDS = register(Histogram('covid_callback_seconds', 'Latency of the Dash callbacks', ['callback']))
+REQUEST_SECONDS = register(Histogram('covid_http_request_seconds', 'Latency of the HTTP requests', ['endpoint']))
+REQUESTS = register(Counter('covid_http_requests_total', 'HTTP requests answered',
+                            ['endpoint', 'method', 'status']))
+CACHE_LOOKUPS = register(Counter('covid_cache_lookups_total', 'Cache lookups by cache and result',
+                                 ['cache', 'result']))
+SLOW_REQUEST_PROFILES = register(Counter('covid_slow_request_profiles_total',
+                                         'Profiles written for requests over PROFILE_SLOW_REQUESTS_MS'))
+register(Gauge('covid_process_info', 'Worker answering the scrape', lambda: [({'pid': os.getpid()}, 1)], ['pid']))
+
+
+@contextlib.contextmanager
+def timed(step):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STEP_SECONDS.observe(time.perf_counter() - started, step=step)
+
+
+@contextlib.contextmanager
+def timed_figure(graph, phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        FIGURE_SECONDS.observe(time.perf_counter() - started, graph=graph, phase=phase)
+
+
+class SlowRequestProfiler:
+    # One sampler thread for the whole process, sampling only the threads that are inside a
+    # request (sys._current_frames), so idle workers cost nothing
+
+    def __init__(self, threshold_ms, interval_ms=5, output_dir='profiles'):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.active = {}
+        self.thread = None
+
+    def start_request(self):
+        with self.lock:
+            self.active[threading.get_ident()] = collections.Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.sample, name='request-profiler', daemon=True)
+                self.thread.start()
+
+    def end_request(self, name, elapsed):
+        with self.lock:
+            samples = self.active.pop(threading.get_ident(), None)
+        if samples and elapsed >= self.threshold:
+            self.write(name, elapsed, samples)
+
+    @staticmethod
+    def collapse(frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+    def sample(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, samples in self.active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[self.collapse(frame)] += 1
+
+    def write(self, name, elapsed, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'root'
+        path = os.path.join(self.output_dir,
+                            f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{safe_name}-{elapsed * 1000:.0f}ms.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in samples.most_common():
+                f.write(f'{stack} {count}\n')
+        SLOW_REQUEST_PROFILES.inc()
+        print(f'Slow request {name} ({elapsed * 1000:.0f} ms), profile written to {path}')
+
+
+def callback_name():
+    # The output a Dash callback request is for, e.g. 'main-graph.figure'
+    if not flask.request.path.endswith('/_dash-update-component'):
+        return None
+    return (flask.request.get_json(silent=True) or {}).get('output')
+
+
+def instrument_server(server, profiler=None):
+    # Request counts and latencies for every request, callback latencies for the Dash callbacks.
+    # Must be registered before any before_request hook that answers requests itself
+    # (serve_figure_payload), so those are timed too.
+
+    @server.before_request
+    def start_timer():
+        flask.g.instrumentation_started = time.perf_counter()
+        if profiler is not None:
+            profiler.start_request()
+
+    @server.after_request
+    def record_status(response):
+        flask.g.instrumentation_status = response.status_code
+        return response
+
+    @server.teardown_request
+    def record_request(exception):
+        started = flask.g.pop('instrumentation_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        # The URL rule rather than the path, so the number of series stays bounded
+        endpoint = flask.request.url_rule.rule if flask.request.url_rule else 'unmatched'
+        status = flask.g.pop('instrumentation_status', 500)
+        REQUESTS.inc(endpoint=endpoint, method=flask.request.method, status=status)
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+        callback = callback_name()
+        if callback is not None:
+            CALLBACK_SECONDS.observe(elapsed, callback=callback)
+        if profiler is not None:
+            profiler.end_request(callback or flask.request.path, elapsed)
@@ -0,0 +1,59 @@
+import datetime
+import sqlite3
+import threading
+
+# Persistent record of what the downloader fetched: one row per (day, source file) with the
+# outcome, the schema variant it was parsed as, its row count and the sha256 of the body.
+# Rows are committed one at a time, so a run that dies halfway keeps everything it finished.
+#
+# status is 'ok' (parsed and stored), 'not_found' (404) or 'failed' (any other HTTP status).
+
+OK = 'ok'
+NOT_FOUND = 'not_found'
+FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS fetches (
+    day TEXT NOT NULL,
+    source TEXT NOT NULL,
+    status TEXT NOT NULL,
+    http_status INTEGER,
+    variant TEXT,
+    row_count INTEGER,
+    content_hash TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (day, source)
+)
+'''
+
+
+class IngestionJournal:
+
+    def __init__(self, path='ingestion_journal.sqlite3'):
+        self.path = path
+        # Written from the download threads too; sqlite3 objects are not thread safe by themselves
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(SCHEMA)
+
+    def record(self, day, source, status, http_status=None, variant=None, row_count=None, content_hash=None):
+        fetched_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO fetches VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (day, source, status, http_status, variant, row_count, content_hash,
+                                     fetched_at))
+
+    def days(self, status, sources):
+        # Set of days for which every one of sources has the given status
+        placeholders = ','.join('?' * len(sources))
+        with self.lock:
+            rows = self.connection.execute(f'SELECT day FROM fetches WHERE status = ? AND source IN ({placeholders}) '
+                                           f'GROUP BY day HAVING COUNT(DISTINCT source) = ?',
+                                           (status, *sources, len(sources))).fetchall()
+        return {row[0] for row in rows}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,184 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+import instrumentation
+
+population_galicia_2020 = 2701819
+
+AREA = 'Área Sanitaria'
+DATE = 'Fecha'
+
+# ----------- Metric definitions
+# Day to day differences, per area: 'Diff <column>'
+DIFF_COLUMNS = ['Casos confirmados por PCR nas últimas 24 horas',
+                'Falecidos',
+                'Curados',
+                'Contaxiados',
+                'Probas PCR realizadas',
+                'Pacientes con infección activa',
+                'Probas serolóxicas realizadas']
+
+# Sums of columns (computed after the diffs)
+SUM_METRICS = {
+    'Suma_Hospitalizados_UCI': ['Hospitalizados hoxe', 'Coidados intensivos hoxe'],
+    'Novos positivos': ['Diff Pacientes con infección activa', 'Diff Curados', 'Diff Falecidos']
+}
+
+# Running means, per area: name -> (column, window, scale)
+ROLLING_METRICS = {
+    'Media 7 días': ('Casos confirmados por PCR nas últimas 24 horas', 7, 1),
+    'Media 14 días': ('Casos confirmados por PCR nas últimas 24 horas', 14, 1),
+    'Media 7 días Casos Activos': ('Pacientes con infección activa', 7, 1),
+    'Media 14 días Casos Activos': ('Pacientes con infección activa', 14, 1),
+    'Incidencia 7 días Casos Activos': ('Pacientes con infección activa', 7, 100000 / population_galicia_2020),
+    'Incidencia 14 días Casos Activos': ('Pacientes con infección activa', 14, 100000 / population_galicia_2020),
+    'Media 7 días Novos positivos': ('Novos positivos', 7, 1),
+    'Media 14 días Novos positivos': ('Novos positivos', 14, 1)
+}
+
+# Bump when the way metrics are computed changes, so cached results are not reused
+METRICS_VERSION = 1
+
+DEFINITIONS_KEY = hashlib.sha1(repr((METRICS_VERSION, DIFF_COLUMNS, SUM_METRICS,
+                                     sorted(ROLLING_METRICS.items()))).encode('utf-8')).hexdigest()
+
+
+def group_positions(areas):
+    # Position of every row inside its area, for rows sorted by (area, date)
+    codes = pd.factorize(areas)[0]
+    starts = np.r_[0, np.flatnonzero(codes[1:] != codes[:-1]) + 1]
+    lengths = np.diff(np.r_[starts, len(codes)])
+    return np.arange(len(codes)) - np.repeat(starts, lengths)
+
+
+def rolling_mean(values, positions, window):
+    # values is sorted by (area, date). A window is only valid when it does not cross into the
+    # previous area and holds no NaN, the same as groupby().rolling(window).mean()
+    nans = np.isnan(values)
+    sums = np.r_[0.0, np.cumsum(np.where(nans, 0.0, values))]
+    nan_counts = np.r_[0, np.cumsum(nans)]
+    result = np.full(len(values), np.nan)
+    end = np.arange(window, len(values) + 1)
+    valid = (positions[window - 1:] >= window - 1) & (nan_counts[end] == nan_counts[end - window])
+    result[window - 1:] = np.where(valid, (sums[end] - sums[end - window]) / window, np.nan)
+    return result
+
+
+def area_diff(values, first_of_area):
+    # Day to day difference for values sorted by (area, date); NaN on the first day of every area
+    diff = np.r_[np.nan, values[1:] - values[:-1]]
+    diff[first_of_area] = np.nan
+    return diff
+
+
+def compute_metrics(main_df):
+    # Every metric in a single pass over the rows sorted by (area, date), so a missing area on
+    # some day only affects that area instead of shifting every later diff
+    df = main_df.sort_values([AREA, DATE], kind='mergesort')
+    positions = group_positions(df[AREA].to_numpy())
+    first_of_area = positions == 0
+
+    columns = {}
+    with instrumentation.timed('metrics.diff'):
+        for column in DIFF_COLUMNS:
+            columns[f'Diff {column}'] = area_diff(df[column].to_numpy(dtype='float64'), first_of_area)
+
+    with instrumentation.timed('metrics.sum'):
+        for name, summands in SUM_METRICS.items():
+            columns[name] = sum(columns[c] if c in columns else df[c].to_numpy() for c in summands)
+
+    with instrumentation.timed('metrics.rolling'):
+        means = {}
+        for name, (column, window, scale) in ROLLING_METRICS.items():
+            if (column, window) not in means:
+                values = columns[column] if column in columns else df[column].to_numpy(dtype='float64')
+                means[(column, window)] = rolling_mean(values, positions, window)
+            columns[name] = means[(column, window)] * scale
+
+    with instrumentation.timed('metrics.assemble'):
+        extended_df = pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+        # Back to the (date, area) order the figures expect
+        return extended_df.sort_values([DATE, AREA], kind='mergesort')
+
+
+def compute_exitus_metrics(activos_curados_falecidos_df):
+    # Daily deaths ('Falecidos Diarios') and their 7 day mean per area from the cumulative Exitus
+    df = activos_curados_falecidos_df.sort_values([AREA, 'Data'], kind='mergesort')
+    positions = group_positions(df[AREA].to_numpy())
+    daily = area_diff(df['Exitus'].to_numpy(dtype='float64'), positions == 0)
+    df['Falecidos Diarios'] = daily
+    df['Media 7 días'] = rolling_mean(daily, positions, 7)
+    return df.sort_values(['Data', AREA], kind='mergesort')
+
+
+def update_metrics(extended_df, new_df):
+    # Metrics for new_df (days after everything in extended_df) appended to extended_df. Only the
+    # last rows of every area are needed as context: a diff looks one day back and the widest
+    # window looks max_window - 1 days back on top of it.
+    context_rows = max(window for _, window, _ in ROLLING_METRICS.values())
+    context_df = extended_df.groupby(AREA, observed=True, sort=False).tail(context_rows)[new_df.columns]
+
+    tail_df = compute_metrics(pd.concat([context_df, new_df], ignore_index=True))
+    # compute_metrics keeps the index, so the context rows are the first len(context_df) labels
+    tail_df = tail_df[tail_df.index >= len(context_df)]
+
+    extended_df = pd.concat([extended_df, tail_df], ignore_index=True)
+    if extended_df[AREA].dtype == object:
+        # Concatenating categoricals with different categories falls back to object
+        extended_df[AREA] = extended_df[AREA].astype('category')
+    return extended_df
+
+
+def data_version(main_df):
+    # Key of the input data plus the metric definitions
+    data_hash = hashlib.sha1(pd.util.hash_pandas_object(main_df, index=False).to_numpy().tobytes()).hexdigest()
+    return hashlib.sha1(f'{data_hash}{DEFINITIONS_KEY}'.encode('utf-8')).hexdigest()
+
+
+def load_metrics(main_df, cache_dir='metrics_cache', version=None, previous_main_df=None,
+                 previous_extended_df=None):
+    # Cached compute_metrics(): results are stored on disk by data version.
+    # Given the previous build, and when main_df only adds later days to it, just those days
+    # are computed (update_metrics) instead of the whole history. When a past day was revised
+    # (bulk imports, a re-downloaded day) everything is computed again.
+    cache_path = os.path.join(cache_dir, f'{version or data_version(main_df)}.pkl')
+    try:
+        with instrumentation.timed('metrics.cache_read'):
+            extended_df = pd.read_pickle(cache_path)
+        instrumentation.CACHE_LOOKUPS.inc(cache='metrics', result='hit')
+        return extended_df
+    except FileNotFoundError:
+        instrumentation.CACHE_LOOKUPS.inc(cache='metrics', result='miss')
+
+    extended_df = None
+    if previous_main_df is not None and previous_extended_df is not None:
+        new = main_df[DATE] > previous_main_df[DATE].max()
+        new_df = main_df[new]
+        if (len(main_df) - len(new_df) == len(previous_main_df)
+                and data_version(main_df[~new]) == data_version(previous_main_df)):
+            with instrumentation.timed('metrics.update'):
+                extended_df = update_metrics(previous_extended_df, new_df)
+    if extended_df is None:
+        with instrumentation.timed('metrics.compute'):
+            extended_df = compute_metrics(main_df)
+    os.makedirs(cache_dir, exist_ok=True)
+    # One temporary file per process: every gunicorn worker may miss the cache at once
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    extended_df.to_pickle(tmp_path)
+    try:
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Another process stored the same version meanwhile: same result, keep theirs
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    # Only the latest version is worth keeping
+    for file_name in os.listdir(cache_dir):
+        if file_name.endswith('.pkl') and os.path.join(cache_dir, file_name) != cache_path:
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+    return extended_df
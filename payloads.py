@@ -0,0 +1,72 @@
+import datetime
+import gzip
+import json
+
+import brotli
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder below is used instead
+    orjson = None
+
+# Content-Encodings a payload is stored in, by preference
+ENCODINGS = ['br', 'gzip']
+
+
+def to_json_compatible(obj):
+    # Fallback for what neither encoder handles natively: numpy arrays/scalars and dates.
+    # NaN becomes null, as plotly's own encoder does (JSON.parse rejects NaN).
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == 'M':
+            return np.datetime_as_string(obj).tolist()
+        if obj.dtype.kind == 'f':
+            return np.where(np.isnan(obj), None, obj).tolist()
+        return [to_json_compatible(v) for v in obj.tolist()] if obj.dtype.kind == 'O' else obj.tolist()
+    if isinstance(obj, np.generic):
+        return to_json_compatible(obj.item())
+    if isinstance(obj, float) and obj != obj:
+        return None
+    if isinstance(obj, (datetime.date, datetime.datetime)):
+        return obj.isoformat()
+    if hasattr(obj, 'to_plotly_json'):
+        return obj.to_plotly_json()
+    if isinstance(obj, (list, tuple)):
+        return [to_json_compatible(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: to_json_compatible(v) for k, v in obj.items()}
+    return obj
+
+
+def dumps(obj):
+    # JSON bytes for plotly figures holding numpy arrays, without going through
+    # plotly.utils.PlotlyJSONEncoder
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=to_json_compatible,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(to_json_compatible(obj), default=to_json_compatible).encode('utf-8')
+
+
+def build_payload(component_id, component_property, value):
+    # The body Dash sends back for a single output callback, serialized once and compressed
+    # once for every encoding in ENCODINGS
+    if hasattr(value, 'to_plotly_json'):
+        value = value.to_plotly_json()
+    return encode(dumps({'response': {component_id: {component_property: value}}, 'multi': True}))
+
+
+def encode(body):
+    return {'identity': body,
+            'br': brotli.compress(body, quality=5),
+            'gzip': gzip.compress(body, compresslevel=6)}
+
+
+def choose_encoding(accept_encoding):
+    accepted = {e.split(';')[0].strip() for e in (accept_encoding or '').lower().split(',')}
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return 'identity'
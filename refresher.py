@@ -0,0 +1,89 @@
+import datetime
+import fcntl
+import os
+import threading
+import time
+
+import datastore
+import instrumentation
+from downloader import DataLoader
+
+
+class DataRefresher:
+    # Keeps a dataset built by build_dataset() up to date from a background thread.
+    # Readers take self.dataset once per request; a refresh builds a complete new dataset and
+    # then rebinds the attribute, so nobody ever sees a half-built one and no restart is needed.
+    # Downloads happen every interval seconds, in one worker at a time; the store is checked every
+    # poll_interval seconds, so the other workers pick up what that one downloaded right away.
+
+    def __init__(self, build_dataset, interval, poll_interval=60, download=True, lock_path='refresh.lock'):
+        self.build_dataset = build_dataset
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.download = download
+        self.lock_path = lock_path
+        self.listeners = []
+        with instrumentation.timed('build_dataset'):
+            self.dataset = build_dataset()
+        # After the build, which may have rebuilt the store from the csv files
+        self.data_version = self.store_version()
+        self.loaded_at = time.time()
+
+    def add_listener(self, listener):
+        # listener(dataset) is called after every swap, e.g. to invalidate caches
+        self.listeners.append(listener)
+
+    @staticmethod
+    def store_version():
+        parts = datastore.store_parts(datastore.TOTAL_DATA_STORE) + \
+            datastore.store_parts(datastore.ACTIVOS_CURADOS_FALECIDOS_STORE)
+        return max((os.path.getmtime(part_path) for part_path in parts), default=0)
+
+    def download_new_data(self):
+        # Only one gunicorn worker downloads at a time; the others just pick up the new store
+        with open(self.lock_path, 'w') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            today = datetime.date.today()
+            loader = DataLoader()
+            loader.get_new_data(datastore.load_total_data(), today)
+            loader.get_activos_curados_falecidos(today)
+
+    def refresh(self):
+        if self.download:
+            with instrumentation.timed('download'):
+                self.download_new_data()
+        self.reload()
+
+    def reload(self):
+        # New dataset if the store changed, downloaded by this worker or another one
+        data_version = self.store_version()
+        if data_version != self.data_version:
+            with instrumentation.timed('build_dataset'):
+                dataset = self.build_dataset(self.dataset)
+            self.dataset = dataset
+            self.data_version = data_version
+            self.loaded_at = time.time()
+            for listener in self.listeners:
+                listener(dataset)
+            print(f'Dataset refreshed ({datetime.datetime.fromtimestamp(data_version)})')
+
+    def run(self):
+        next_download = time.time() + self.interval
+        while True:
+            time.sleep(min(self.poll_interval or self.interval, self.interval))
+            try:
+                if time.time() >= next_download:
+                    next_download = time.time() + self.interval
+                    self.refresh()
+                else:
+                    self.reload()
+            except Exception as e:
+                # Keep serving the current dataset, try again on the next poll
+                print(f'Refresh failed: {e!r}')
+
+    def start(self):
+        if self.interval > 0:
+            threading.Thread(target=self.run, name='data-refresher', daemon=True).start()
@@ -0,0 +1,88 @@
+import collections
+import datetime
+import hashlib
+import json
+import os
+
+import requests
+
+CachedResponse = collections.namedtuple('CachedResponse', ['status_code', 'content', 'changed'])
+
+
+class ResponseCache:
+    # On-disk cache of the Sergas responses.
+    # - 200 responses keep their body, ETag/Last-Modified and a sha256 of the content, so the next
+    #   request is conditional and an unchanged payload can be skipped by the caller (changed=False).
+    # - 404 responses are remembered for negative_ttl, during which the url is not requested again.
+
+    def __init__(self, cache_dir='http_cache', negative_ttl=datetime.timedelta(hours=6)):
+        self.cache_dir = cache_dir
+        self.negative_ttl = negative_ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{key}.json'), os.path.join(self.cache_dir, f'{key}.body')
+
+    @staticmethod
+    def write_atomic(path, data):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def read_meta(self, url):
+        meta_path, body_path = self.paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta['status_code'] == requests.codes.ok and not os.path.exists(body_path):
+            return None
+        return meta
+
+    def write_meta(self, url, meta):
+        meta_path, _ = self.paths(url)
+        self.write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def get(self, session, url):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        meta = self.read_meta(url)
+        _, body_path = self.paths(url)
+
+        headers = {}
+        if meta is not None and meta['status_code'] == requests.codes.not_found:
+            fetched_at = datetime.datetime.fromisoformat(meta['fetched_at'])
+            if now - fetched_at < self.negative_ttl:
+                return CachedResponse(requests.codes.not_found, b'', False)
+        elif meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        response = session.get(url, headers=headers)
+
+        if response.status_code == requests.codes.not_modified:  # i.e status = 304
+            with open(body_path, 'rb') as f:
+                content = f.read()
+            return CachedResponse(requests.codes.ok, content, False)
+
+        if response.status_code == requests.codes.ok:  # i.e status = 200
+            content_hash = hashlib.sha256(response.content).hexdigest()
+            changed = meta is None or meta.get('sha256') != content_hash
+            if changed:
+                self.write_atomic(body_path, response.content)
+            self.write_meta(url, {'status_code': response.status_code,
+                                  'etag': response.headers.get('ETag'),
+                                  'last_modified': response.headers.get('Last-Modified'),
+                                  'sha256': content_hash,
+                                  'fetched_at': now.isoformat()})
+            return CachedResponse(response.status_code, response.content, changed)
+
+        if response.status_code == requests.codes.not_found:  # i.e status = 404
+            self.write_meta(url, {'status_code': response.status_code,
+                                  'fetched_at': now.isoformat()})
+
+        return CachedResponse(response.status_code, response.content, True)
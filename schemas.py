@@ -0,0 +1,157 @@
+import csv
+import io
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# The daily files published by SERGAS, by variant: which columns each has (by name, in any
+# order), how they are renamed to the columns we store, and their dtypes. Parsing goes straight
+# from the response bytes with usecols and explicit dtypes, and the header is checked against
+# the variant first, so a changed upstream file fails loudly instead of being mis-parsed.
+
+Variant = namedtuple('Variant', ['name', 'file_suffix', 'columns', 'renames', 'dtypes'])
+
+COUNTER = 'int32'
+# Below this size (the daily files have one row per area) the csv module parses a file several
+# times faster than read_csv, whose per call setup costs more than the parsing itself
+SMALL_FILE_BYTES = 64 * 1024
+
+TOTAL_COLUMNS = ['Fecha', 'Area_Sanitaria', 'Casos_Totais', 'Casos_Confirmados_PCR_Ultimas24h',
+                 'Pacientes_Sin_Alta', 'Pacientes_Con_Alta', 'Camas_Ocupadas_HOS', 'Camas_Ocupadas_UCI',
+                 'Probas_Realizadas_PCR', 'Probas_Realizadas_Non_PCR', 'Exitus']
+TOTAL_DTYPES = {'Fecha': str, 'Area_Sanitaria': str, **{c: COUNTER for c in TOTAL_COLUMNS[2:]}}
+
+PDIA_RENAMES = {'Probas_Realizadas_Non_PDIA': 'Probas_Realizadas_Non_PCR',
+                'Casos_Confirmados_PDIA_Ultimas24h': 'Casos_Confirmados_PCR_Ultimas24h'}
+PDIA_INVERSE = {stored: source for source, stored in PDIA_RENAMES.items()}
+
+ACTIVOS_COLUMNS = ['Fecha', 'Area_Sanitaria', 'Pacientes_Sin_Alta', 'Pacientes_Con_Alta', 'Exitus']
+
+VARIANTS = {
+    'CifrasTotais': Variant('CifrasTotais', 'COVID19_Web_CifrasTotais.csv',
+                            columns=TOTAL_COLUMNS,
+                            renames={},
+                            dtypes=TOTAL_DTYPES),
+    # Same figures with PDIA instead of PCR in two names, plus Probas_Antixenos_Realizadas, which
+    # we do not store
+    'CifrasTotais_PDIA': Variant('CifrasTotais_PDIA', 'COVID19_Web_CifrasTotais_PDIA.csv',
+                                 columns=[PDIA_INVERSE.get(c, c) for c in TOTAL_COLUMNS],
+                                 renames=PDIA_RENAMES,
+                                 dtypes={PDIA_INVERSE.get(c, c): dtype for c, dtype in TOTAL_DTYPES.items()}),
+    'ActivosCuradosFallecidos': Variant('ActivosCuradosFallecidos', 'COVID19_Web_ActivosCuradosFallecidos.csv',
+                                        columns=ACTIVOS_COLUMNS,
+                                        renames={},
+                                        dtypes={'Fecha': str, 'Area_Sanitaria': str,
+                                                **{c: COUNTER for c in ACTIVOS_COLUMNS[2:]}}),
+}
+
+# Columns a variant may have on top of its own without that being drift
+IGNORED_COLUMNS = {'CifrasTotais_PDIA': {'Probas_Antixenos_Realizadas'}}
+
+
+class SchemaDriftError(ValueError):
+    # The header of a file does not have the columns of its variant, or a row does not have the
+    # fields of the header
+
+    def __init__(self, variant, missing=(), unexpected=(), message=None):
+        self.variant = variant
+        self.missing = missing
+        self.unexpected = unexpected
+        super().__init__(message or f'{variant}: missing columns {missing}, unexpected columns {unexpected}')
+
+
+def file_name(a_date, variant):
+    return f'{a_date}_{VARIANTS[variant].file_suffix}'
+
+
+def variant_of(file_name):
+    # Variant of a file name like 2021-11-04_COVID19_Web_CifrasTotais.csv, None if not one of ours
+    for variant in VARIANTS.values():
+        if file_name.endswith(f'_{variant.file_suffix}'):
+            return variant.name
+    return None
+
+
+def read_header(content):
+    first_line = content.split(b'\n', 1)[0].decode('utf-8-sig').strip('\r')
+    return next(csv.reader([first_line]))
+
+
+def check(variant, header):
+    # (missing, unexpected) columns of header for the variant
+    expected = set(VARIANTS[variant].columns)
+    present = set(header)
+    return sorted(expected - present), sorted(present - expected - IGNORED_COLUMNS.get(variant, set()))
+
+
+def identify(header):
+    # Variants whose columns the header has, best match (fewest unexpected columns) first
+    matches = [(len(check(variant, header)[1]), variant) for variant in VARIANTS if not check(variant, header)[0]]
+    return [variant for _, variant in sorted(matches)]
+
+
+def stored_columns(variant):
+    schema = VARIANTS[variant]
+    return [schema.renames.get(c, c) for c in schema.columns]
+
+
+def to_number(value, dtype):
+    # Spanish formatting, as read_csv(thousands='.', decimal=',')
+    value = value.replace('.', '')
+    return int(value) if np.dtype(dtype).kind in 'iu' else float(value.replace(',', '.'))
+
+
+def parse_small(content, schema, header):
+    rows = list(csv.reader(content.decode('utf-8-sig').splitlines()))[1:]
+    # A short or long row would be read with its values under the wrong columns
+    for line, row in enumerate(rows, 2):
+        if row and len(row) != len(header):
+            raise SchemaDriftError(schema.name, message=f'{schema.name}: line {line} has {len(row)} fields, '
+                                                        f'the header {len(header)}')
+    positions = {name: position for position, name in enumerate(header)}
+    columns = {}
+    for name in schema.columns:
+        values = [row[positions[name]] for row in rows if row]
+        dtype = schema.dtypes[name]
+        if dtype is str:
+            columns[name] = np.array(values, dtype=object)
+        else:
+            columns[name] = np.array([to_number(value, dtype) for value in values], dtype=dtype)
+    return pd.DataFrame(columns)
+
+
+def parse(content, variant):
+    # (DataFrame, variant) from the raw bytes of a file published as the given variant. The
+    # frame has the stored column names in the stored order. A header that is really another
+    # variant of the same data is parsed as that one; missing columns otherwise raise
+    # SchemaDriftError. Extra columns are reported and left out.
+    header = read_header(content)
+    missing, unexpected = check(variant, header)
+    if missing:
+        alternatives = [v for v in identify(header) if stored_columns(v) == stored_columns(variant)]
+        if not alternatives:
+            raise SchemaDriftError(variant, missing, unexpected)
+        print(f'Schema drift: a {variant} file has the columns of {alternatives[0]}, parsed as such')
+        variant = alternatives[0]
+        missing, unexpected = check(variant, header)
+    if unexpected:
+        print(f'Schema drift in {variant}: ignoring unexpected columns {unexpected}')
+
+    schema = VARIANTS[variant]
+    if len(content) < SMALL_FILE_BYTES:
+        df = parse_small(content, schema, header)
+    else:
+        df = pd.read_csv(io.BytesIO(content),
+                         encoding='utf-8-sig',
+                         usecols=schema.columns,
+                         dtype=schema.dtypes,
+                         thousands='.',
+                         decimal=',')
+    if schema.renames:
+        df.columns = [schema.renames.get(c, c) for c in df.columns]
+    columns = stored_columns(variant)
+    # usecols keeps the order of the file
+    if list(df.columns) != columns:
+        df = df[columns]
+    return df, variant
@@ -0,0 +1,53 @@
+import os
+import shutil
+
+from cube import DataCube
+
+
+def materialize_cubes(shared_dir, version, build_cubes, loaders=None):
+    # Cubes of a dataset version as memory-mapped files under shared_dir/version. The first
+    # process to need a version builds and saves it; the rest (and later restarts) just map it,
+    # so every gunicorn worker reads the same physical pages.
+    # build_cubes() may return other objects with a save(path) too; loaders has the function
+    # that maps each of those back ({name: load(path)}), DataCube.load is used for the rest.
+    path = os.path.join(shared_dir, version)
+    if not os.path.isdir(path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        for name, cube in build_cubes().items():
+            cube.save(os.path.join(tmp_path, name))
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker published the same version first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        remove_old_versions(shared_dir, version)
+
+    loaders = loaders or {}
+    return {name: loaders.get(name, DataCube.load)(os.path.join(path, name)) for name in os.listdir(path)}
+
+
+def remove_old_versions(shared_dir, version):
+    # Processes still mapping an old version keep their pages until they unmap them
+    for name in os.listdir(shared_dir):
+        if name != version and not name.endswith('.tmp'):
+            shutil.rmtree(os.path.join(shared_dir, name), ignore_errors=True)
+
+
+def memory_usage():
+    # Resident (rss) and proportional (pss, shared pages divided among the processes mapping
+    # them) memory of this process in kB. pss is what shows the savings of the shared mode.
+    usage = {'pid': os.getpid()}
+    for path, fields in (('/proc/self/status', {'VmRSS:': 'rss_kb'}),
+                         ('/proc/self/smaps_rollup', {'Pss:': 'pss_kb', 'Shared_Clean:': 'shared_kb'})):
+        try:
+            with open(path) as f:
+                for line in f:
+                    parts = line.split()
+                    if parts and parts[0] in fields:
+                        usage[fields[parts[0]]] = int(parts[1])
+        except OSError:
+            pass
+    if 'rss_kb' not in usage:
+        import resource
+        usage['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+
+import flask
+
+import instrumentation
+import payloads
+
+# Static snapshots of the views most visitors ask for, rebuilt after every data refresh:
+#
+#   SNAPSHOT_DIR/<version>/index.html, _dash-layout, _dash-dependencies   the page as served
+#   SNAPSHOT_DIR/<version>/callbacks/<key>                                 callback responses
+#   SNAPSHOT_DIR/current -> <version>
+#
+# Every file is there as is, .br and .gz. A front server can serve the shell files of current
+# straight from disk; the app answers them and every callback whose output and inputs match a
+# snapshot exactly from these files too, before any dataset or figure code runs.
+
+SHELL = {'/': ('index.html', 'text/html'),
+         '/_dash-layout': ('_dash-layout', 'application/json'),
+         '/_dash-dependencies': ('_dash-dependencies', 'application/json')}
+SUFFIXES = {'identity': '', 'br': '.br', 'gzip': '.gz'}
+# Requests made while building a snapshot carry this header, so they are not answered from the
+# previous one
+BUILD_HEADER = 'X-Snapshot-Build'
+CURRENT = 'current'
+# Seconds a front server may keep a snapshot response; the data changes hourly at most
+MAX_AGE = 60
+
+
+def callback_key(output, inputs):
+    # inputs as Dash posts them: [{'id', 'property', 'value'}]. Lists of strings (the areas) are
+    # compared as sets, the figures do not depend on the order they were picked in.
+    values = []
+    for item in inputs:
+        value = item.get('value')
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            value = sorted(value)
+        values.append((item.get('id'), item.get('property'), value))
+    normalized = json.dumps([output, sorted(values, key=lambda v: (str(v[0]), str(v[1])))],
+                            sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def write_files(path, payload):
+    for encoding, suffix in SUFFIXES.items():
+        with open(path + suffix, 'wb') as f:
+            f.write(payload[encoding])
+
+
+def write_snapshot(snapshot_dir, version, shell, callbacks):
+    # shell: {file name: payload}, callbacks: {key: payload}, payloads as payloads.build_payload()
+    # returns them. The version directory is written aside and renamed into place, then current
+    # is switched to it, so readers never see a partial snapshot.
+    path = os.path.join(snapshot_dir, version)
+    if not os.path.isdir(path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        os.makedirs(os.path.join(tmp_path, 'callbacks'), exist_ok=True)
+        for name, payload in shell.items():
+            write_files(os.path.join(tmp_path, name), payload)
+        for key, payload in callbacks.items():
+            write_files(os.path.join(tmp_path, 'callbacks', key), payload)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker published the same version first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    link = os.path.join(snapshot_dir, f'{CURRENT}.{os.getpid()}.tmp')
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(version, link)
+    os.replace(link, os.path.join(snapshot_dir, CURRENT))
+    remove_old_versions(snapshot_dir, version)
+    print(f'Snapshot {version} written: {len(callbacks)} callback responses')
+
+
+def remove_old_versions(snapshot_dir, version):
+    # The previous version stays: a request may be reading it right now
+    versions = [name for name in os.listdir(snapshot_dir)
+                if name != CURRENT and not name.endswith('.tmp') and name != version]
+    versions.sort(key=lambda name: os.path.getmtime(os.path.join(snapshot_dir, name)))
+    for name in versions[:-1]:
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+
+def snapshot_response(path, mimetype, version):
+    encoding = payloads.choose_encoding(flask.request.headers.get('Accept-Encoding'))
+    try:
+        with open(path + SUFFIXES[encoding], 'rb') as f:
+            body = f.read()
+    except FileNotFoundError:
+        return None
+    if flask.request.if_none_match.contains(version):
+        return flask.Response(status=304)
+    response = flask.Response(body, mimetype=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['ETag'] = f'"{version}"'
+    response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}'
+    return response
+
+
+def register_snapshots(server, snapshot_dir):
+    # before_request hook answering from SNAPSHOT_DIR/current: register it before the hooks that
+    # build responses (serve_figure_payload), after the instrumentation ones
+
+    @server.before_request
+    def serve_snapshot():
+        if flask.request.headers.get(BUILD_HEADER):
+            return None
+        if flask.request.method == 'GET' and flask.request.path in SHELL:
+            key_path, mimetype = SHELL[flask.request.path]
+        elif flask.request.method == 'POST' and flask.request.path.endswith('/_dash-update-component'):
+            body = flask.request.get_json(silent=True) or {}
+            mimetype = 'application/json'
+            key_path = os.path.join('callbacks', callback_key(body.get('output'), body.get('inputs', [])))
+        else:
+            return None
+        try:
+            version = os.readlink(os.path.join(snapshot_dir, CURRENT))
+        except OSError:
+            return None
+        response = snapshot_response(os.path.join(snapshot_dir, version, key_path), mimetype, version)
+        instrumentation.CACHE_LOOKUPS.inc(cache='snapshots', result='miss' if response is None else 'hit')
+        return response
@@ -0,0 +1,220 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from cube import AREA
+
+# The data table, paged, sorted and filtered on the server (DataTable with page_action,
+# sort_action and filter_action 'custom'): the browser only ever gets the page it shows.
+#
+# The rows are indexed by area, each area's rows sorted by day, so the area and date terms of a
+# filter query are a dictionary lookup and two binary searches per area; the remaining terms
+# (on the numeric columns) are only evaluated on the rows those leave.
+
+DATE = 'Data'
+# {column} operator value, as DataTable writes filter_query; terms are joined with &&
+TERM = re.compile(r'^\{(?P<column>[^}]+)\}\s*(?P<operator>s=|i=|=|eq|!=|ne|>=|ge|<=|le|>|gt|<|lt|'
+                  r'icontains|scontains|contains|datestartswith)\s*(?P<value>.*)$')
+OPERATORS = {'eq': '=', 's=': '=', 'i=': '=', 'ne': '!=', 'ge': '>=', 'le': '<=', 'gt': '>', 'lt': '<',
+             'icontains': 'contains', 'scontains': 'contains'}
+
+
+def parse_filter(filter_query):
+    # [(column, operator, value)]; terms that do not parse are left out, as DataTable does with
+    # the invalid ones
+    terms = []
+    for part in (filter_query or '').split(' && '):
+        match = TERM.match(part.strip())
+        if match is None:
+            continue
+        value = match.group('value').strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1]
+        operator = OPERATORS.get(match.group('operator'), match.group('operator'))
+        terms.append((match.group('column'), operator, value))
+    return terms
+
+
+DATE_UNITS = {4: 'Y', 7: 'M', 10: 'D'}
+
+
+def date_bounds(value):
+    # First and last day of a full or partial date: 2021, 2021-03 or 2021-03-15 (a time after the
+    # day is ignored). Anything else is a ValueError, never a coarser date than the one written.
+    value = value.strip()
+    length = 10 if len(value) > 10 and value[10] in ' T' else len(value)
+    try:
+        first = np.datetime64(value[:length], DATE_UNITS[length])
+    except (KeyError, ValueError):
+        raise ValueError(f'Not a date: {value!r}') from None
+    return first.astype('datetime64[D]'), (first + 1).astype('datetime64[D]') - 1
+
+
+class TableIndex:
+
+    def __init__(self, table_df):
+        self.columns = list(table_df.columns)
+        self.numeric_columns = [c for c in self.columns if c not in (DATE, AREA)]
+        days = pd.to_datetime(table_df[DATE]).to_numpy().astype('datetime64[D]')
+        area_codes, areas = pd.factorize(table_df[AREA].astype(str))
+        self.areas = list(areas)
+        self.days = days
+        self.area_codes = area_codes
+        # One row per numeric column, so every column is contiguous
+        self.matrix = np.vstack([table_df[c].to_numpy(dtype='float64') for c in self.numeric_columns]) \
+            if self.numeric_columns else np.zeros((0, len(table_df)))
+        # Row positions sorted by area and then day, and the first position of every area
+        self.order = np.lexsort((days, area_codes))
+        self.boundaries = np.r_[0, np.flatnonzero(np.diff(area_codes[self.order])) + 1, len(self.order)]
+        self.sorted_days = days[self.order]
+        self.index_areas()
+
+    def index_areas(self):
+        # Views on the arrays (memory-mapped ones too): per area, its row positions sorted by
+        # day and those days for the binary searches, plus each column's values
+        self.values = {c: self.matrix[i] for i, c in enumerate(self.numeric_columns)}
+        # Alphabetical rank of every area, for sorting by the area column
+        self.area_ranks = np.argsort(np.argsort(np.array(self.areas, dtype=object)))
+        self.area_rows = {}
+        self.area_days = {}
+        for start, end in zip(self.boundaries[:-1], self.boundaries[1:]):
+            if end > start:
+                area = self.areas[self.area_codes[self.order[start]]]
+                self.area_rows[area] = self.order[start:end]
+                self.area_days[area] = self.sorted_days[start:end]
+
+    def save(self, path):
+        # As DataCube.save(), for SHARED_DATA_DIR
+        os.makedirs(path, exist_ok=True)
+        for name in ('days', 'area_codes', 'matrix', 'order', 'boundaries', 'sorted_days'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(path, 'labels.json'), 'w', encoding='utf-8') as f:
+            json.dump({'columns': self.columns, 'areas': self.areas}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mmap_mode = 'r' if mmap else None
+        index = cls.__new__(cls)
+        for name in ('days', 'area_codes', 'matrix', 'order', 'boundaries', 'sorted_days'):
+            setattr(index, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode))
+        with open(os.path.join(path, 'labels.json'), encoding='utf-8') as f:
+            labels = json.load(f)
+        index.columns = labels['columns']
+        index.areas = labels['areas']
+        index.numeric_columns = [c for c in index.columns if c not in (DATE, AREA)]
+        index.index_areas()
+        return index
+
+    def match_areas(self, operator, value):
+        value = value.lower()
+        if operator == '=':
+            return {a for a in self.areas if a.lower() == value}
+        if operator == '!=':
+            return {a for a in self.areas if a.lower() != value}
+        if operator == 'contains':
+            return {a for a in self.areas if value in a.lower()}
+        return set()
+
+    def rows(self, terms):
+        # Row positions matching the area and date terms, through the index. A term that cannot
+        # be applied (not a date, an operator the column has no meaning for) matches no row.
+        nothing = np.zeros(0, dtype=int)
+        areas = set(self.areas)
+        lo, hi = None, None
+        for column, operator, value in terms:
+            if column == AREA:
+                areas &= self.match_areas(operator, value)
+            elif column == DATE:
+                try:
+                    first, last = date_bounds(value)
+                except ValueError:
+                    return nothing
+                if operator in ('=', 'contains', 'datestartswith'):
+                    lo, hi = max(lo, first) if lo is not None else first, min(hi, last) if hi is not None else last
+                elif operator in ('>=', '>'):
+                    bound = first if operator == '>=' else last + 1
+                    lo = max(lo, bound) if lo is not None else bound
+                elif operator in ('<=', '<'):
+                    bound = last if operator == '<=' else first - 1
+                    hi = min(hi, bound) if hi is not None else bound
+                else:
+                    return nothing
+
+        rows = []
+        for area in self.areas:
+            if area not in areas:
+                continue
+            area_days = self.area_days[area]
+            start = 0 if lo is None else np.searchsorted(area_days, lo, side='left')
+            end = len(area_days) if hi is None else np.searchsorted(area_days, hi, side='right')
+            rows.append(self.area_rows[area][start:end])
+        return np.concatenate(rows) if rows else nothing
+
+    def filter_values(self, rows, terms):
+        # The terms on the numeric columns, on the rows left by the index; as in rows(), one that
+        # is not a number or has a text operator matches no row
+        for column, operator, value in terms:
+            if column not in self.values:
+                continue
+            try:
+                number = float(value.replace(',', '.'))
+            except ValueError:
+                return rows[:0]
+            values = self.values[column][rows]
+            if operator == '=':
+                rows = rows[values == number]
+            elif operator == '!=':
+                rows = rows[values != number]
+            elif operator == '>=':
+                rows = rows[values >= number]
+            elif operator == '>':
+                rows = rows[values > number]
+            elif operator == '<=':
+                rows = rows[values <= number]
+            elif operator == '<':
+                rows = rows[values < number]
+            else:
+                return rows[:0]
+        return rows
+
+    def sort_keys(self, rows, column, descending):
+        if column == DATE:
+            key = self.days[rows].astype('int64')
+        elif column == AREA:
+            key = self.area_ranks[self.area_codes[rows]]
+        else:
+            key = self.values[column][rows]
+            # Empty cells last in both directions
+            key = np.where(np.isnan(key), -np.inf if descending else np.inf, key)
+        return -key if descending else key
+
+    def sort(self, rows, sort_by):
+        # Latest day first, areas in data order, unless sort_by says otherwise
+        keys = [self.sort_keys(rows, item['column_id'], item.get('direction') == 'desc')
+                for item in sort_by or [] if item.get('column_id') in self.columns]
+        # np.lexsort sorts by the last key first
+        keys = [self.area_codes[rows], -self.days[rows].astype('int64')] + keys[::-1]
+        return rows[np.lexsort(keys)]
+
+    def records(self, rows):
+        days = np.datetime_as_string(self.days[rows])
+        columns = {DATE: days.tolist(),
+                   AREA: [self.areas[code] for code in self.area_codes[rows]]}
+        for column in self.numeric_columns:
+            values = self.values[column][rows]
+            columns[column] = [None if value != value else int(value) if value.is_integer() else round(value, 4)
+                               for value in values.tolist()]
+        return [dict(zip(self.columns, row)) for row in zip(*(columns[c] for c in self.columns))]
+
+    def page(self, page_current, page_size, sort_by, filter_query):
+        # (records of the page, page count)
+        terms = parse_filter(filter_query)
+        rows = self.filter_values(self.rows(terms), terms)
+        page_size = max(int(page_size or 1), 1)
+        page_count = max(-(-len(rows) // page_size), 1)
+        page_current = min(max(int(page_current or 0), 0), page_count - 1)
+        rows = self.sort(rows, sort_by)[page_current * page_size:(page_current + 1) * page_size]
+        return self.records(rows), page_count
@@ -0,0 +1,48 @@
+import collections
+import json
+
+import flask
+import pandas as pd
+
+from api import register_api, split_list
+from cube import AREA, DataCube
+
+AREAS = ['A.S. VIGO', 'A.S. LUGO, A MARIÑA E MONFORTE', 'A.S. OURENSE, VERÍN E O BARCO']
+Dataset = collections.namedtuple('Dataset', ['cube', 'exitus_cube', 'version'])
+
+
+def make_client():
+    df = pd.DataFrame({'Data': pd.to_datetime(['2021-01-01'] * 3 + ['2021-01-02'] * 3),
+                       AREA: AREAS * 2,
+                       'Contaxiados': [1, 2, 3, 4, 5, 6]})
+    dataset = Dataset(DataCube(df), DataCube(df), 'test')
+    server = flask.Flask(__name__)
+    register_api(server, lambda: dataset)
+    return server.test_client()
+
+
+def test_split_list_keeps_names_with_commas():
+    known = set(AREAS)
+    assert split_list(['A.S. LUGO, A MARIÑA E MONFORTE'], known) == ['A.S. LUGO, A MARIÑA E MONFORTE']
+    assert split_list(['A.S. VIGO,A.S. OURENSE, VERÍN E O BARCO'], known) == ['A.S. VIGO',
+                                                                             'A.S. OURENSE, VERÍN E O BARCO']
+    assert split_list(['a, b'], known) == ['a', 'b']
+
+
+def test_series_areas_with_commas():
+    client = make_client()
+    response = client.get('/api/v1/series', query_string=[('area', 'A.S. LUGO, A MARIÑA E MONFORTE'),
+                                                          ('area', 'A.S. OURENSE, VERÍN E O BARCO')])
+    assert response.status_code == 200
+    rows = json.loads(response.get_data())['data']
+    assert sorted({row[AREA] for row in rows}) == sorted(AREAS[1:])
+
+    response = client.get('/api/v1/series', query_string={'area': 'A.S. VIGO,A.S. LUGO, A MARIÑA E MONFORTE',
+                                                           'columns': 'Contaxiados'})
+    assert response.status_code == 200
+    assert {row[AREA] for row in json.loads(response.get_data())['data']} == set(AREAS[:2])
+
+
+def test_series_unknown_area():
+    response = make_client().get('/api/v1/series', query_string={'area': 'A.S. LUGO'})
+    assert response.status_code == 400
@@ -0,0 +1,54 @@
+import os
+
+import pandas as pd
+import pytest
+
+import datastore
+import metrics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Column names of main_df in app.build_dataset
+COLUMNS = ['Fecha', 'Área Sanitaria', 'Contaxiados', 'Casos confirmados por PCR nas últimas 24 horas',
+           'Pacientes con infección activa', 'Curados', 'Hospitalizados hoxe', 'Coidados intensivos hoxe',
+           'Probas PCR realizadas', 'Probas serolóxicas realizadas', 'Falecidos']
+
+
+def main_df():
+    # Typed as the store loads it (int32 counters, categorical areas)
+    df = datastore.to_schema(pd.read_csv(os.path.join(ROOT, datastore.TOTAL_DATA_CSV)), datastore.TOTAL_DATA_SCHEMA)
+    df.columns = COLUMNS
+    days = df['Fecha'].dt.normalize()
+    # One area missing on one of the last days
+    missing_day = sorted(days.unique())[-5]
+    df = df[~((days == missing_day) & (df['Área Sanitaria'] == 'A.S. VIGO'))]
+    return df.sort_values(['Fecha', 'Área Sanitaria'], kind='mergesort').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('k', [1, 3, 7, 15])
+def test_update_metrics_matches_full_recompute(k):
+    df = main_df()
+    last_days = sorted(df['Fecha'].dt.normalize().unique())[-k:]
+    new = df['Fecha'].dt.normalize().isin(last_days)
+
+    updated = metrics.update_metrics(metrics.compute_metrics(df[~new]), df[new])
+    expected = metrics.compute_metrics(df)
+
+    pd.testing.assert_frame_equal(updated.reset_index(drop=True), expected.reset_index(drop=True))
+
+
+def test_load_metrics_recomputes_revised_past_days(tmp_path):
+    df = main_df()
+    last_day = df['Fecha'].max()
+    previous_df = df[df['Fecha'] < last_day].reset_index(drop=True)
+    previous_extended_df = metrics.load_metrics(previous_df, cache_dir=str(tmp_path))
+
+    # A past day revised together with the new one, as a bulk import does
+    revised_df = df.copy()
+    first_day = revised_df['Fecha'].min()
+    revised_df.loc[revised_df['Fecha'] == first_day, 'Casos confirmados por PCR nas últimas 24 horas'] += 1000
+
+    for current_df in (df, revised_df):
+        extended_df = metrics.load_metrics(current_df, cache_dir=str(tmp_path), previous_main_df=previous_df,
+                                           previous_extended_df=previous_extended_df)
+        pd.testing.assert_frame_equal(extended_df.reset_index(drop=True),
+                                      metrics.compute_metrics(current_df).reset_index(drop=True))
@@ -0,0 +1,80 @@
+import datetime
+import os
+
+import requests
+
+from benchmarks.http_stub import serve_directory
+from response_cache import ResponseCache
+
+FILE_NAME = '2021-11-04_COVID19_Web_CifrasTotais.csv'
+
+
+class CountingSession(requests.Session):
+    # Requests sent, with their headers
+
+    def __init__(self):
+        super().__init__()
+        self.sent = []
+
+    def get(self, url, **kwargs):
+        self.sent.append(kwargs.get('headers', {}))
+        return super().get(url, **kwargs)
+
+
+def write_file(directory, content, mtime):
+    path = os.path.join(directory, FILE_NAME)
+    with open(path, 'wb') as f:
+        f.write(content)
+    os.utime(path, (mtime, mtime))
+
+
+def test_conditional_request_not_modified(tmp_path):
+    site = tmp_path / 'site'
+    site.mkdir()
+    write_file(site, b'Fecha\n2021-11-04\n', 1636000000)
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    session = CountingSession()
+    with serve_directory(str(site)) as base_url:
+        first = cache.get(session, f'{base_url}/{FILE_NAME}')
+        second = cache.get(session, f'{base_url}/{FILE_NAME}')
+
+    assert (first.status_code, first.changed) == (200, True)
+    assert 'If-Modified-Since' in session.sent[1]
+    assert (second.status_code, second.content, second.changed) == (200, b'Fecha\n2021-11-04\n', False)
+
+
+def test_same_content_is_not_changed(tmp_path):
+    site = tmp_path / 'site'
+    site.mkdir()
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    session = CountingSession()
+    with serve_directory(str(site)) as base_url:
+        write_file(site, b'Fecha\n2021-11-04\n', 1636000000)
+        first = cache.get(session, f'{base_url}/{FILE_NAME}')
+        # Published again with the same content: a full 200 response, same hash
+        write_file(site, b'Fecha\n2021-11-04\n', 1636100000)
+        second = cache.get(session, f'{base_url}/{FILE_NAME}')
+        write_file(site, b'Fecha\n2021-11-05\n', 1636200000)
+        third = cache.get(session, f'{base_url}/{FILE_NAME}')
+
+    assert first.changed and not second.changed and third.changed
+    assert third.content == b'Fecha\n2021-11-05\n'
+
+
+def test_not_found_is_remembered_for_negative_ttl(tmp_path):
+    site = tmp_path / 'site'
+    site.mkdir()
+    cache = ResponseCache(str(tmp_path / 'cache'), negative_ttl=datetime.timedelta(hours=1))
+    session = CountingSession()
+    with serve_directory(str(site)) as base_url:
+        url = f'{base_url}/{FILE_NAME}'
+        assert cache.get(session, url).status_code == 404
+        assert cache.get(session, url).status_code == 404
+        assert len(session.sent) == 1
+
+        # Past the ttl the url is requested again, and found once published
+        expired = ResponseCache(str(tmp_path / 'cache'), negative_ttl=datetime.timedelta(0))
+        write_file(site, b'Fecha\n2021-11-04\n', 1636000000)
+        response = expired.get(session, url)
+        assert len(session.sent) == 2
+        assert (response.status_code, response.changed) == (200, True)
@@ -0,0 +1,29 @@
+import pytest
+
+import schemas
+
+HEADER = ','.join(schemas.TOTAL_COLUMNS)
+ROW = '2021-11-04 18:00:00,"A.S. LUGO, A MARIÑA E MONFORTE",3301,34,483,2727,24,5,63536,59414,91'
+
+
+def content(*rows):
+    return '\n'.join([HEADER, *rows]).encode('utf-8')
+
+
+def test_parse_small_file():
+    df, variant = schemas.parse(content(ROW, ''), 'CifrasTotais')
+    assert variant == 'CifrasTotais'
+    assert df['Area_Sanitaria'].tolist() == ['A.S. LUGO, A MARIÑA E MONFORTE']
+    assert df['Exitus'].tolist() == [91]
+
+
+@pytest.mark.parametrize('row', [ROW.rsplit(',', 1)[0], ROW + ',7', '2021-11-04 18:00:00'])
+def test_row_width_mismatch_is_drift(row):
+    with pytest.raises(schemas.SchemaDriftError, match='line 3'):
+        schemas.parse(content(ROW, row), 'CifrasTotais')
+
+
+def test_missing_column_is_drift():
+    header = ','.join(schemas.TOTAL_COLUMNS[:-1])
+    with pytest.raises(schemas.SchemaDriftError):
+        schemas.parse(f'{header}\n{ROW.rsplit(",", 1)[0]}'.encode('utf-8'), 'CifrasTotais')
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+
+from table import AREA, DATE, TableIndex, date_bounds
+
+
+def table():
+    days = pd.date_range('2020-12-30', '2021-01-03').date
+    return TableIndex(pd.DataFrame({DATE: [day for day in days for _ in range(2)],
+                                    AREA: ['A.S. VIGO', 'A.S. FERROL'] * len(days),
+                                    'Contaxiados': range(2 * len(days))}))
+
+
+def test_date_bounds():
+    assert [str(day) for day in date_bounds('2021-02')] == ['2021-02-01', '2021-02-28']
+    assert [str(day) for day in date_bounds('2021-01-03 18:00:00')] == ['2021-01-03', '2021-01-03']
+    for value in ('2021-13-01', '2021-0', 'marzo'):
+        with pytest.raises(ValueError):
+            date_bounds(value)
+
+
+@pytest.mark.parametrize('filter_query, count', [
+    ('', 10),
+    ('{Data} = 2021', 6),
+    ('{Data} >= 2021-01-02 && {Área Sanitaria} = a.s. vigo', 2),
+    ('{Contaxiados} > 7', 2),
+    # Terms that cannot be applied match nothing instead of being left out
+    ('{Data} = 2021-13-01', 0),
+    ('{Contaxiados} contains 5', 0),
+    ('{Contaxiados} > muchos', 0),
+    ('{Área Sanitaria} datestartswith A', 0),
+])
+def test_filter(filter_query, count):
+    records, page_count = table().page(0, 100, [], filter_query)
+    assert len(records) == count
+    assert page_count == 1
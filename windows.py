@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+from metrics import population_galicia_2020
+
+# Means, sums and incidences over any window, for every metric of a DataCube. The cube is
+# summed once along the day axis, per area and metric; the sum of any window ending on day t is
+# then sums[t + 1] - sums[t + 1 - window], so a request costs two lookups per point whatever the
+# window, with no rolling pass over the data.
+#
+# Like groupby().rolling(window), a window is only valid when it has a value for every one of its
+# days: NaN (and days an area has no row for) are counted the same way and invalidate it.
+
+STATISTICS = {
+    # name -> (divide by the window, scale)
+    'mean': (True, 1),
+    'sum': (False, 1),
+    # Per 100000 inhabitants, as the 'Incidencia N días' metrics
+    'incidence': (True, 100000 / population_galicia_2020),
+}
+
+
+class WindowEngine:
+
+    def __init__(self, cube, sums=None, nans=None):
+        # sums and nans as save() wrote them (memory-mapped in shared mode), else computed here
+        self.cube = cube
+        if sums is not None and nans is not None:
+            self.sums, self.nans = sums, nans
+            return
+        values = np.asarray(cube.values)
+        nans = np.isnan(values)
+        n_days, n_areas, n_metrics = values.shape
+        # One leading row of zeros, so the windows starting on the first day need no special case
+        self.sums = np.zeros((n_days + 1, n_areas, n_metrics), dtype='float64')
+        np.cumsum(np.where(nans, 0, values), axis=0, dtype='float64', out=self.sums[1:])
+        self.nans = np.zeros((n_days + 1, n_areas, n_metrics), dtype='int32')
+        np.cumsum(nans, axis=0, dtype='int32', out=self.nans[1:])
+
+    def save(self, path):
+        # Next to the cubes in SHARED_DATA_DIR, so the workers map them instead of each keeping
+        # its own copy
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'sums.npy'), self.sums)
+        np.save(os.path.join(path, 'nans.npy'), self.nans)
+
+    def select(self, start_date, end_date, areas, metric, window, statistic='mean'):
+        # Same (days, areas, values, present) as DataCube.select() for one metric, with values
+        # the statistic over the window days up to and including every day
+        divide, scale = STATISTICS[statistic]
+        cube = self.cube
+        days = cube.day_range(start_date, end_date)
+        area_indices = cube.area_indices(areas)
+        metric_index = cube.metric_positions[metric]
+
+        ends = np.arange(days.start + 1, days.stop + 1)
+        starts = ends - window
+        complete = starts >= 0
+        starts = np.maximum(starts, 0)
+
+        sums = self.sums[:, area_indices, metric_index]
+        nans = self.nans[:, area_indices, metric_index]
+        values = sums[ends] - sums[starts]
+        if divide:
+            values /= window
+        values *= scale
+        values[~complete[:, None] | (nans[ends] != nans[starts])] = np.nan
+        present = cube.present[days][:, area_indices]
+        return cube.days[days], [cube.areas[i] for i in area_indices], values[:, :, None], present
+
+
+def load_prefix_sums(path, mmap=True):
+    # {'sums', 'nans'} written by WindowEngine.save(), for WindowEngine(cube, **arrays)
+    mmap_mode = 'r' if mmap else None
+    return {'sums': np.load(os.path.join(path, 'sums.npy'), mmap_mode=mmap_mode),
+            'nans': np.load(os.path.join(path, 'nans.npy'), mmap_mode=mmap_mode)}